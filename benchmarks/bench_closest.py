@@ -0,0 +1,51 @@
+"""
+compares the per-row `find_closest_coordinates` loop with the `SpatialIndex`
+batched query
+
+run from the repo root with `python -m benchmarks.bench_closest`
+"""
+
+import time
+
+import numpy as np
+
+from lib import SpatialIndex, find_closest_coordinates
+
+GDANSK = [54.352, 18.6466]
+
+
+def random_coords(n: int, spread: float = 0.1, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.array(GDANSK) + rng.uniform(-spread, spread, size=(n, 2))
+
+
+def bench(n_apartments: int, n_ammenities: int):
+    apartments = random_coords(n_apartments, seed=1)
+    ammenities = random_coords(n_ammenities, seed=2)
+
+    start = time.perf_counter()
+    looped = [
+        find_closest_coordinates(coords, ammenities) for coords in apartments
+    ]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = SpatialIndex(ammenities)
+    indexed = index.closest_coordinates(apartments)
+    index_time = time.perf_counter() - start
+
+    # the loop is degree-euclidean, the index is haversine; at Gdansk's
+    # latitude a degree of longitude is only ~0.59 of a degree of latitude,
+    # so the loop picks the wrong place for a good chunk of the apartments
+    agreement = np.mean(np.all(np.isclose(looped, indexed), axis=1))
+
+    print(
+        f"apartments={n_apartments:>6} ammenities={n_ammenities:>5} "
+        f"loop={loop_time:8.3f}s index={index_time:7.3f}s "
+        f"speedup={loop_time / index_time:7.1f}x agreement={agreement:.3f}"
+    )
+
+
+if __name__ == "__main__":
+    for n_apartments, n_ammenities in [(1_000, 100), (7_000, 500), (7_000, 2_000)]:
+        bench(n_apartments, n_ammenities)
@@ -0,0 +1,55 @@
+"""
+counts the distance matrix requests `get_distances` sends for the main.py
+workload (every apartment to the city center, every apartment to its closest
+ammenity) against the one-request-per-pair `get_distance` loop
+
+runs in a scratch directory against the stub client, so it is offline and
+does not touch the real caches
+
+run from the repo root with `python -m benchmarks.bench_distances`
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from lib import HowCloseIsItService
+from benchmarks.stub_gmaps import StubGoogleMapsClient
+
+GDANSK = [54.352, 18.6466]
+
+
+def main(n_apartments: int = 7_000, n_ammenities: int = 300):
+    rng = np.random.default_rng(0)
+    apartments = (np.array(GDANSK) + rng.uniform(-0.1, 0.1, (n_apartments, 2)))
+    # listings share addresses, round to get realistic repeats
+    apartments = np.round(apartments, 3).tolist()
+    ammenities = (np.array(GDANSK) + rng.uniform(-0.1, 0.1, (n_ammenities, 2)))
+    closest = ammenities[rng.integers(0, n_ammenities, n_apartments)].tolist()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            stub = StubGoogleMapsClient()
+            service = HowCloseIsItService(gmaps=stub)
+            service.get_distances(apartments, [GDANSK] * n_apartments)
+            service.get_distances(apartments, closest)
+            # second pass is served from the cache
+            service.get_distances(apartments, closest)
+            service.flush()
+        finally:
+            os.chdir(cwd)
+
+    # the packed requests carry no cross elements, so the cached per-pair
+    # loop would have sent one request per element
+    print(
+        f"pairs={3 * n_apartments} requests={stub.calls['distance_matrix']} "
+        f"elements={stub.elements} "
+        f"(per-pair get_distance: {stub.elements} requests)"
+    )
+
+
+if __name__ == "__main__":
+    main()
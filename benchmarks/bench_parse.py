@@ -0,0 +1,45 @@
+"""
+per-page parse time of the checked-in `page.txt`, the old full-soup
+`get_items_from_page` against slicing __NEXT_DATA__ out of the raw HTML
+
+run from the repo root with `python -m benchmarks.bench_parse`
+"""
+
+import json
+import re
+import timeit
+
+from bs4 import BeautifulSoup
+
+from lib.scrape import extract_next_data, get_page_count, get_items_from_page
+
+
+def soup_items(page: str) -> list:
+    soup = BeautifulSoup(page, "lxml")
+    next_data_script = soup.find("script", {"id": "__NEXT_DATA__"})
+    data = json.loads(next_data_script.string)  # type: ignore
+    return data["props"]["pageProps"]["data"]["searchAds"]["items"]
+
+
+def soup_page_count(page: str) -> int:
+    match = re.search('"page_count":([0-9]+)', str(BeautifulSoup(page, "lxml")))
+    return int(match.group(1))  # type: ignore
+
+
+def bench(name: str, fn, number: int):
+    seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print(f"{name:<28} {seconds * 1000:8.2f} ms/page")
+
+
+if __name__ == "__main__":
+    with open("page.txt") as f:
+        page = f.read()
+
+    assert soup_items(page) == get_items_from_page(page, save=False)
+    assert soup_page_count(page) == get_page_count(page)
+
+    bench("items, soup (before)", lambda: soup_items(page), 5)
+    bench("items, sliced (after)", lambda: get_items_from_page(page, save=False), 50)
+    bench("  of which JSON decode", lambda: extract_next_data(page), 50)
+    bench("page count, soup (before)", lambda: soup_page_count(page), 5)
+    bench("page count, raw (after)", lambda: get_page_count(page), 50)
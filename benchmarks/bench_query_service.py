@@ -0,0 +1,157 @@
+"""
+p50/p99 latency and throughput of the offer query service under load, at
+increasing request rates and numbers of concurrent clients, against a
+synthetic enriched dataset (or a real one with --dataset)
+
+requests are sent on a fixed schedule (open loop) and latency is measured
+from when a request was due, so a server falling behind shows up in the
+tail instead of slowing the clients down
+
+run from the repo root with `python -m benchmarks.bench_query_service`, or
+e.g. `python -m benchmarks.bench_query_service --listings 100000 --rates 500`
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from lib import OfferIndex, load_dataset, serve_offers
+from benchmarks.synthetic import GDANSK, synthetic_coords
+
+AMMENITIES = ["skm", "park", "restauracja", "szkoła"]
+
+QUERIES = [
+    "/offers?max_price=500000&near=skm:800&limit=10",
+    "/offers?max_price=700000&min_floor_size=50&sort=price_per_m2&limit=20",
+    "/offers?near=park:300&near=skm:1000&max_price_per_m2=12000",
+    "/offers?lat=54.372&lng=18.62&radius=1500&sort=-floor_size&limit=5",
+    "/offers?min_number_of_rooms=3&max_distance_to_center=4000&limit=50",
+    "/offers?max_price=400000",
+]
+
+
+def synthetic_dataset(n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    n listings shaped like what `load_dataset` returns for final_df.parquet
+    """
+    rng = np.random.default_rng(seed)
+    coords = synthetic_coords(n, seed=seed)
+    floor_size = np.round(rng.uniform(20, 120, n), 1)
+    price_per_m2 = rng.uniform(8_000, 20_000, n).round()
+    price = (floor_size * price_per_m2).round()
+    hidden = rng.random(n) < 0.15
+    df = pd.DataFrame({
+        "id": np.arange(60_000_000, 60_000_000 + n),
+        "title": [f"Mieszkanie {size} m2" for size in floor_size],
+        "url": [f"https://www.otodom.pl/pl/oferta/mieszkanie-{i}" for i in range(n)],
+        "address": [f"ul. Grunwaldzka {i % 300}, Gdańsk" for i in range(n)],
+        "price": np.where(hidden, np.nan, price),
+        "price_per_m2": np.where(hidden, np.nan, price_per_m2),
+        "floor_size": floor_size,
+        "number_of_rooms": rng.integers(1, 6, n),
+        "coords_lat": coords[:, 0],
+        "coords_lon": coords[:, 1],
+        "distance_to_center": np.linalg.norm(coords - GDANSK, axis=1) * 90_000,
+    })
+    for ammenity in AMMENITIES:
+        df[f"distance_to_closest_{ammenity}"] = rng.gamma(2, 400, n)
+    return df
+
+
+def _get(url: str) -> int:
+    with urllib.request.urlopen(url) as response:
+        return len(json.loads(response.read()))
+
+
+def load_test(
+    base_url: str,
+    rate: float,
+    clients: int,
+    duration: float,
+) -> dict[str, float]:
+    """
+    sends `rate` requests per second for `duration` seconds from `clients`
+    threads, cycling through QUERIES
+
+    :return: p50/p99/max latency in ms and the achieved requests per second
+    """
+    n = max(1, int(rate * duration))
+    queries = itertools.cycle(QUERIES)
+    latencies = np.empty(n)
+    lock = threading.Lock()
+    errors = 0
+    start = time.perf_counter() + 0.05
+
+    def send(i: int, path: str):
+        nonlocal errors
+        due = start + i / rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            _get(base_url + path)
+        except OSError:
+            with lock:
+                errors += 1
+        latencies[i] = time.perf_counter() - due
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for i in range(n):
+            pool.submit(send, i, next(queries))
+    elapsed = time.perf_counter() - start
+    return {
+        "p50_ms": float(np.percentile(latencies, 50) * 1_000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1_000),
+        "max_ms": float(latencies.max() * 1_000),
+        "rps": n / elapsed,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listings", type=int, default=10_000)
+    parser.add_argument(
+        "--dataset", help="final_df.parquet (or data/final_df) to serve instead")
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=3)
+    args = parser.parse_args()
+
+    df = load_dataset(args.dataset) if args.dataset else synthetic_dataset(args.listings)
+
+    # in-process query times, without HTTP and JSON
+    index = OfferIndex(df)
+    for path in QUERIES:
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+        kwargs = index.parse_query(query)
+        start = time.perf_counter()
+        for _ in range(100):
+            offers = index.query(**kwargs)
+        ms = (time.perf_counter() - start) * 10
+        print(f"{path:<72} {ms:7.3f}ms  offers={len(offers)}")
+
+    print(f"\nlistings={len(df)} duration={args.duration}s")
+    print(f"{'rate':>6} {'clients':>7} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'rps':>8} {'errors':>6}")
+    with serve_offers(df) as base_url:
+        for rate, clients in itertools.product(args.rates, args.clients):
+            result = load_test(base_url, rate, clients, args.duration)
+            print(
+                f"{rate:>6.0f} {clients:>7} {result['p50_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['max_ms']:>8.2f} "
+                f"{result['rps']:>8.1f} {result['errors']:>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
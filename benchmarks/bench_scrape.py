@@ -0,0 +1,43 @@
+"""
+scrapes the 99 pages `page.txt` claims from a local stand-in, serially and
+concurrently, with 5% of the requests failing
+
+run from the repo root with `python -m benchmarks.bench_scrape`
+"""
+
+import os
+import tempfile
+import time
+
+from lib import get_pages
+from benchmarks.stub_otodom import serve_otodom
+
+
+def bench(page_path: str, workers: int, rate: float, burst: int):
+    cwd = os.getcwd()
+    with serve_otodom(page_path, failure_rate=0.05) as base_url:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                start = time.perf_counter()
+                pages = get_pages(
+                    load=False,
+                    save=False,
+                    workers=workers,
+                    rate=rate,
+                    burst=burst,
+                    base_url=base_url,
+                )
+                elapsed = time.perf_counter() - start
+            finally:
+                os.chdir(cwd)
+    print(
+        f"\nworkers={workers} rate={rate}/s pages={len(pages)} "
+        f"took {elapsed:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    page_path = os.path.abspath("page.txt")
+    bench(page_path, workers=1, rate=100, burst=1)
+    bench(page_path, workers=8, rate=20, burst=8)
@@ -0,0 +1,195 @@
+"""
+throughput and peak memory of every pipeline stage on synthetic data at
+1k/10k/100k listings, offline (stub googlemaps client, scratch directory)
+
+run from the repo root with `python -m benchmarks.bench_stages`, or e.g.
+`python -m benchmarks.bench_stages --scales 1000 --stages parse preprocess`
+"""
+
+import argparse
+import itertools
+import os
+import tempfile
+import time
+import tracemalloc
+
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from lib import (
+    AccessibilityGrid,
+    AmmenitiesTable,
+    HowCloseIsItService,
+    KVStore,
+    SpatialIndex,
+    get_items_from_page,
+    plan_search_centers,
+    preprocess_items_df,
+)
+from benchmarks.stub_gmaps import StubGoogleMapsClient
+from benchmarks.synthetic import (
+    GDANSK,
+    synthetic_ammenities,
+    synthetic_coords,
+    synthetic_items,
+    synthetic_page,
+)
+
+# distinct pages generated for the parse stage, cycled to reach the scale
+MAX_DISTINCT_PAGES = 10
+
+
+def setup_parse(n: int) -> Callable:
+    per_page = 72
+    n_pages = -(-n // per_page)
+    items = synthetic_items(min(n, per_page * MAX_DISTINCT_PAGES))
+    pages = [
+        synthetic_page(items[i:i + per_page], n_pages)
+        for i in range(0, len(items), per_page)
+    ]
+
+    def run():
+        for page in itertools.islice(itertools.cycle(pages), n_pages):
+            get_items_from_page(page, save=False)
+
+    return run
+
+
+def setup_preprocess(n: int) -> Callable:
+    items_df = pd.DataFrame(synthetic_items(n))
+    return lambda: preprocess_items_df(items_df)
+
+
+def setup_nearest(n: int) -> Callable:
+    apartments = synthetic_coords(n, seed=1)
+    ammenities = synthetic_coords(max(100, n // 10), seed=2)
+    return lambda: SpatialIndex(ammenities).nearest(apartments)
+
+
+def setup_ammenities_table(n: int) -> Callable:
+    cache = synthetic_ammenities(max(100, n // 10))
+    return lambda: AmmenitiesTable.from_cache(cache).view("skm").index
+
+
+def setup_accessibility(n: int) -> Callable:
+    apartments = synthetic_coords(n, seed=1)
+    table = AmmenitiesTable.from_cache(synthetic_ammenities(1_000))
+    grid = AccessibilityGrid.build(table, apartments)
+    return lambda: [
+        grid.count_at(apartments, ammenity, radius)
+        for ammenity in grid.types
+        for radius in grid.radii
+    ]
+
+
+def setup_cache_io(n: int) -> Callable:
+    response = StubGoogleMapsClient().geocode("Gdańsk, ul. Pomorska")
+
+    def run():
+        store = KVStore("bench_cache.db")
+        for i in range(n):
+            store[f"address {i}"] = response
+        store.flush()
+        for i in range(n):
+            store[f"address {i}"]
+        store.close()
+        os.remove("bench_cache.db")
+
+    return run
+
+
+def setup_distances(n: int) -> Callable:
+    # listings share addresses, rounding gives realistic repeats
+    apartments = np.round(synthetic_coords(n, seed=1), 3).tolist()
+
+    def run():
+        for path in ("distance_cache.db", "cache.db"):
+            if os.path.exists(path):
+                os.remove(path)
+        service = HowCloseIsItService(gmaps=StubGoogleMapsClient())
+        service.get_distances(apartments, [GDANSK] * n)
+        service.flush()
+
+    return run
+
+
+def setup_distance_estimate(n: int) -> Callable:
+    apartments = synthetic_coords(n, seed=1).tolist()
+    service = HowCloseIsItService(gmaps=StubGoogleMapsClient())
+    return lambda: service.distance_column(apartments, [GDANSK], mode="estimate")
+
+
+def setup_plan_search_centers(n: int) -> Callable:
+    # a whole voivodeship rather than one city
+    apartments = synthetic_coords(n, spread=1.0, seed=1)
+    return lambda: plan_search_centers(apartments)
+
+
+STAGES = {
+    "parse": setup_parse,
+    "preprocess": setup_preprocess,
+    "nearest": setup_nearest,
+    "ammenities_table": setup_ammenities_table,
+    "accessibility": setup_accessibility,
+    "cache_io": setup_cache_io,
+    "distances": setup_distances,
+    "distance_estimate": setup_distance_estimate,
+    "plan_search_centers": setup_plan_search_centers,
+}
+
+
+def measure(run: Callable, memory: bool) -> tuple[float, float | None]:
+    """
+    :return: (seconds, peak MB allocated by python), the peak is measured in
+    a second run since tracemalloc slows everything down
+    """
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    if not memory:
+        return seconds, None
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scales", nargs="+", type=int, default=[1_000, 10_000, 100_000])
+    parser.add_argument("--stages", nargs="+", default=list(STAGES))
+    parser.add_argument("--no-memory", action="store_true")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # the stages that open caches open scratch ones
+        os.chdir(tmp)
+        try:
+            for n, name in itertools.product(args.scales, args.stages):
+                seconds, peak = measure(
+                    STAGES[name](n),
+                    memory=not args.no_memory,
+                )
+                rows.append({
+                    "stage": name,
+                    "listings": n,
+                    "seconds": round(seconds, 4),
+                    "listings_per_second": round(n / seconds),
+                    "peak_mb": None if peak is None else round(peak, 1),
+                })
+                print(rows[-1])
+        finally:
+            os.chdir(cwd)
+
+    print()
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
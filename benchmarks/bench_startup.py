@@ -0,0 +1,89 @@
+"""
+time from a fresh interpreter to the first result: importing lib, building a
+HowCloseIsItService, a cached geocode and a column of haversine distances,
+each measured in its own subprocess so nothing is already imported
+
+runs in a scratch directory with a geocode cache of `n_addresses` entries
+and the stub client
+
+run from the repo root with `python -m benchmarks.bench_startup`
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import REPO_ROOT
+
+PRELUDE = f"""
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {REPO_ROOT!r})
+"""
+
+STEPS = {
+    "import lib": "import lib",
+    "import + service": """
+from lib import HowCloseIsItService
+from benchmarks.stub_gmaps import StubGoogleMapsClient
+service = HowCloseIsItService(gmaps=StubGoogleMapsClient())
+""",
+    "first cached geocode": """
+from lib import HowCloseIsItService
+from benchmarks.stub_gmaps import StubGoogleMapsClient
+service = HowCloseIsItService(gmaps=StubGoogleMapsClient())
+service.geocode("Gdańsk, address 0")
+""",
+    "first haversine column": """
+from lib import HowCloseIsItService
+from benchmarks.stub_gmaps import StubGoogleMapsClient
+service = HowCloseIsItService(gmaps=StubGoogleMapsClient())
+service.distance_column([[54.35, 18.64]] * 1000, [[54.36, 18.65]] * 1000, mode="haversine")
+""",
+}
+
+
+def seed_cache(n_addresses: int):
+    from lib import HowCloseIsItService
+    from benchmarks.stub_gmaps import StubGoogleMapsClient
+
+    service = HowCloseIsItService(gmaps=StubGoogleMapsClient())
+    for i in range(n_addresses):
+        service.geocode(f"Gdańsk, address {i}")
+    service.flush()
+
+
+def time_step(code: str) -> float:
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            PRELUDE + code + "\nprint(time.perf_counter() - start)",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main(n_addresses: int = 5_000, repeats: int = 5):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            seed_cache(n_addresses)
+            for name, code in STEPS.items():
+                seconds = [time_step(code) for _ in range(repeats)]
+                print(
+                    f"{name:<24} median={statistics.median(seconds):.3f}s "
+                    f"min={min(seconds):.3f}s"
+                )
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
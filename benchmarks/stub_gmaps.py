@@ -0,0 +1,103 @@
+"""
+offline stand-in for googlemaps.Client, pass it as
+`HowCloseIsItService(gmaps=StubGoogleMapsClient())`
+"""
+
+import hashlib
+import threading
+import time
+
+from lib.spatial import haversine
+
+
+class StubGoogleMapsClient:
+
+    """
+    answers distance matrix requests with the haversine distance times a
+    detour factor, geocodes every address to a point near Gdansk derived from
+    its hash, serves `places_pages` pages of `places_per_page` made-up places
+    for every places search, and counts the requests and elements it was sent
+    """
+
+    DETOUR_FACTOR = 1.3
+    CENTER = [54.352, 18.6466]
+
+    def __init__(
+        self,
+        places_pages: int = 3,
+        places_per_page: int = 20,
+        places_latency: float = 0.0,
+    ):
+        self.calls = {"distance_matrix": 0, "geocode": 0, "places": 0}
+        self.elements = 0
+        self.places_pages = places_pages
+        self.places_per_page = places_per_page
+        self.places_latency = places_latency
+        self._lock = threading.Lock()
+
+    def places(self, query, location, radius=None, page_token="", **kwargs):
+        with self._lock:
+            self.calls["places"] += 1
+        time.sleep(self.places_latency)
+        page = int(page_token.split(":")[-1]) if page_token else 0
+        seed = f"{query}:{location[0]:.4f}:{location[1]:.4f}"
+        results = []
+        for i in range(self.places_per_page):
+            digest = hashlib.sha256(f"{seed}:{page}:{i}".encode()).digest()
+            results.append({
+                "place_id": digest.hex()[:27],
+                "name": f"{query} {page}-{i}",
+                "geometry": {
+                    "location": {
+                        "lat": location[0] + (digest[0] - 128) / 1280,
+                        "lng": location[1] + (digest[1] - 128) / 1280,
+                    }
+                },
+                "formatted_address": f"ul. Testowa {i}, Gdansk",
+                "rating": round(1 + digest[2] / 64, 1),
+                "types": ["point_of_interest"],
+            })
+        res = {"status": "OK", "results": results}
+        if page + 1 < self.places_pages:
+            res["next_page_token"] = f"{seed}:{page + 1}"
+        return res
+
+    def geocode(self, address, **kwargs):
+        self.calls["geocode"] += 1
+        digest = hashlib.sha256(address.encode()).digest()
+        return [
+            {
+                "geometry": {
+                    "location": {
+                        "lat": self.CENTER[0] + (digest[0] - 128) / 1280,
+                        "lng": self.CENTER[1] + (digest[1] - 128) / 1280,
+                    }
+                },
+                "types": ["street_address"],
+                "address_components": [],
+                "formatted_address": address,
+            }
+        ]
+
+    def distance_matrix(self, origins, destinations, mode="walking", **kwargs):
+        self.calls["distance_matrix"] += 1
+        self.elements += len(origins) * len(destinations)
+        return {
+            "status": "OK",
+            "rows": [
+                {
+                    "elements": [
+                        {
+                            "status": "OK",
+                            "distance": {
+                                "value": int(
+                                    haversine(origin, dest) * self.DETOUR_FACTOR
+                                ),
+                            },
+                        }
+                        for dest in destinations
+                    ]
+                }
+                for origin in origins
+            ],
+        }
@@ -0,0 +1,61 @@
+"""
+local HTTP stand-in for otodom serving the saved `page.txt` for every listing
+page, optionally failing a share of the requests to exercise the retries
+
+    with serve_otodom() as base_url:
+        get_pages(load=False, save=False, base_url=base_url)
+"""
+
+import random
+import threading
+import time
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _make_handler(page: bytes, latency: float, failure_rate: float):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            if random.random() < failure_rate:
+                self.send_response(503)
+                self.end_headers()
+                self.wfile.write(b"try again later")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@contextmanager
+def serve_otodom(
+    page_path: str = "page.txt",
+    latency: float = 0.2,
+    failure_rate: float = 0.0,
+):
+    """
+    :param latency: seconds the server waits before answering
+    :param failure_rate: share of the requests answered with a 503
+    :return: base_url to pass to `get_page`/`get_pages`
+    """
+    with open(page_path, "rb") as f:
+        page = f.read()
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        _make_handler(page, latency, failure_rate),
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,146 @@
+"""
+generators of synthetic otodom items, listing pages and ammenities around
+Gdansk, shaped like `sample_entry.json`, `page.txt` and the ammenities cache
+"""
+
+import copy
+import json
+import os
+import re
+
+import numpy as np
+
+from lib.preprocess import ROOMS_NUMBER
+
+GDANSK = [54.352, 18.6466]
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DISTRICTS = [
+    "Wrzeszcz", "Oliwa", "Przymorze", "Jelitkowo", "Zaspa", "Chełm",
+    "Orunia", "Ujeścisko-Łostowice", "Piecki-Migowo", "Śródmieście",
+]
+STREETS = [
+    "ul. Pomorska", "ul. Grunwaldzka", "ul. Chrobrego", "ul. Kartuska",
+    "ul. Jaśkowa Dolina", "ul. Wita Stwosza", "ul. Obrońców Wybrzeża",
+    "ul. Dmowskiego", "ul. Słowackiego", "ul. Hallera",
+]
+
+_NEXT_DATA = re.compile(
+    r'(<script[^>]*\bid="__NEXT_DATA__"[^>]*>)(.*?)(</script>)',
+    re.DOTALL,
+)
+
+
+def _template() -> dict:
+    with open(os.path.join(REPO_ROOT, "sample_entry.json")) as f:
+        return json.load(f)
+
+
+def synthetic_items(n: int, seed: int = 0, hidden_price_rate: float = 0.15) -> list[dict]:
+    """
+    n search items with random ids, prices, sizes, rooms and addresses, the
+    rest of the fields copied from sample_entry.json
+    """
+    rng = np.random.default_rng(seed)
+    template = _template()
+    rooms = list(ROOMS_NUMBER) + ["MORE"]
+    items = []
+    for i in range(n):
+        item = copy.deepcopy(template)
+        area = float(np.round(rng.uniform(20, 120), 1))
+        price_per_m2 = int(rng.uniform(8_000, 20_000))
+        district = DISTRICTS[rng.integers(len(DISTRICTS))]
+        street = STREETS[rng.integers(len(STREETS))]
+        hidden = bool(rng.random() < hidden_price_rate)
+        item["id"] = 60_000_000 + i
+        item["title"] = f"Mieszkanie {area} m2, {district}"
+        item["slug"] = f"mieszkanie-{i}-ID{i:x}"
+        item["areaInSquareMeters"] = area
+        item["roomsNumber"] = rooms[rng.integers(len(rooms))]
+        item["hidePrice"] = hidden
+        item["totalPrice"] = None if hidden else {
+            "value": int(area * price_per_m2),
+            "currency": "PLN",
+            "__typename": "Money",
+        }
+        item["pricePerSquareMeter"] = None if hidden else {
+            "value": price_per_m2,
+            "currency": "PLN",
+            "__typename": "Money",
+        }
+        item["location"]["address"]["street"]["name"] = street
+        item["location"]["reverseGeocoding"]["locations"][-1]["fullName"] = (
+            f"{district}, Gdańsk, pomorskie"
+        )
+        item["locationLabel"]["value"] = f"Gdańsk, {district}, {street}"
+        items.append(item)
+    return items
+
+
+def _page_template() -> str:
+    with open(os.path.join(REPO_ROOT, "page.txt")) as f:
+        return f.read()
+
+
+def synthetic_page(items: list[dict], page_count: int = 1, template: str | None = None) -> str:
+    """
+    the HTML of page.txt with the search items and page count swapped out
+
+    :param template: HTML to use instead of reading page.txt again
+    """
+    page = template or _page_template()
+    match = _NEXT_DATA.search(page)
+    assert match is not None
+    data = json.loads(match.group(2))
+    search_ads = data["props"]["pageProps"]["data"]["searchAds"]
+    search_ads["items"] = items
+    search_ads["pagination"]["totalPages"] = page_count
+    data["props"]["pageProps"]["tracking"]["listing"]["page_count"] = page_count
+    return (
+        page[:match.start(2)]
+        + json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        + page[match.end(2):]
+    )
+
+
+def synthetic_pages(n_items: int, per_page: int = 72, seed: int = 0) -> list[str]:
+    items = synthetic_items(n_items, seed=seed)
+    page_count = -(-n_items // per_page)
+    template = _page_template()
+    return [
+        synthetic_page(items[i:i + per_page], page_count, template)
+        for i in range(0, n_items, per_page)
+    ]
+
+
+def synthetic_coords(n: int, spread: float = 0.1, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.array(GDANSK) + rng.uniform(-spread, spread, size=(n, 2))
+
+
+def synthetic_ammenities(
+    n: int,
+    types: list[str] | None = None,
+    seed: int = 0,
+) -> dict[str, dict[str, dict]]:
+    """
+    an ammenities cache with n places spread over the types
+    """
+    types = types or ["zabka", "biedronka", "lidl", "restauracja", "skm"]
+    rng = np.random.default_rng(seed)
+    coords = synthetic_coords(n, seed=seed)
+    cache: dict[str, dict[str, dict]] = {ammenity: {} for ammenity in types}
+    for i, (lat, lng) in enumerate(coords.tolist()):
+        ammenity = types[i % len(types)]
+        place_id = f"place-{i}"
+        cache[ammenity][place_id] = {
+            "place_id": place_id,
+            "name": f"{ammenity} {i}",
+            "coords": [lat, lng],
+            "address": f"ul. Testowa {i}, Gdańsk",
+            "rating": float(np.round(rng.uniform(1, 5), 1)),
+            "types": ["point_of_interest"],
+            "ammenity": ammenity,
+        }
+    return cache
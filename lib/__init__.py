@@ -1,4 +1,175 @@
-from .how_close_is_it_service import *
-from .preprocess import *
-from .scrape import *
-from .data_science import *
+import importlib
+
+from . import metrics
+
+# name: submodule it lives in; the submodules (and pandas, sklearn,
+# googlemaps, bs4, ... behind them) are only imported when one of their
+# names is first used, so `import lib` itself is cheap
+_EXPORTS = {
+    **dict.fromkeys(
+        [
+            "HowCloseIsItService",
+            "DISTANCE_MATRIX_MAX_ORIGINS",
+            "DISTANCE_MATRIX_MAX_DESTINATIONS",
+            "DISTANCE_MATRIX_MAX_ELEMENTS",
+            "DISTANCE_MODES",
+            "PLACES_NEXT_PAGE_DELAY",
+            "PLACES_RADIUS",
+            "DISTANCE_KEY_DECIMALS",
+            "distance_keys",
+        ],
+        "how_close_is_it_service",
+    ),
+    **dict.fromkeys(
+        [
+            "ROOMS_NUMBER",
+            "COMPACT_DTYPES",
+            "number_of_rooms_to_int",
+            "compact_dtypes",
+            "preprocess_items_df",
+        ],
+        "preprocess",
+    ),
+    **dict.fromkeys(
+        [
+            "get_page_count",
+            "OTODOM_URL",
+            "HEADERS",
+            "get_session",
+            "get_page",
+            "save_pages",
+            "pages_dir",
+            "get_pages",
+            "extract_next_data",
+            "get_next_data",
+            "get_search_ads",
+            "get_items_from_page",
+            "ITEM_FIELDS",
+            "compact_item",
+            "items_dir",
+            "write_items",
+            "read_items",
+            "iter_items",
+            "load_items",
+        ],
+        "scrape",
+    ),
+    **dict.fromkeys(
+        ["run_preds", "euclidean_distance", "find_closest_coordinates"],
+        "data_science",
+    ),
+    **dict.fromkeys(
+        [
+            "EARTH_RADIUS_M",
+            "to_radians",
+            "haversine",
+            "SpatialIndex",
+            "DEFAULT_DETOUR_FACTOR",
+            "detour_factor",
+        ],
+        "spatial",
+    ),
+    "RateLimiter": "rate_limit",
+    "KVStore": "kv_store",
+    **dict.fromkeys(
+        [
+            "COARSE_RESULT_TYPES",
+            "normalize_address",
+            "coords_response",
+            "GeocodingBackend",
+            "CacheGeocoder",
+            "GazetteerGeocoder",
+            "GoogleGeocoder",
+            "GeocoderChain",
+        ],
+        "geocoding",
+    ),
+    "AmmenitiesTable": "ammenities_table",
+    **dict.fromkeys(["DEFAULT_RADII", "AccessibilityGrid"], "accessibility"),
+    **dict.fromkeys(["grid_cells", "plan_search_centers"], "coverage"),
+    **dict.fromkeys(
+        [
+            "FINGERPRINT_FIELDS",
+            "LATEST_FIRST",
+            "item_fingerprint",
+            "items_fingerprints",
+            "load_fingerprints",
+            "save_fingerprints",
+            "iter_changed_items",
+            "merge_delta",
+        ],
+        "incremental",
+    ),
+    **dict.fromkeys(
+        [
+            "BASE_FEATURES",
+            "MODELS",
+            "DEFAULT_MODEL",
+            "feature_columns",
+            "training_frame",
+            "make_pipeline",
+            "compare_models",
+            "data_hash",
+            "fit_pipeline",
+            "score_listings",
+            "rank_underpriced",
+        ],
+        "modelling",
+    ),
+    **dict.fromkeys(["content_hash", "Stage", "StageGraph"], "stages"),
+    **dict.fromkeys(
+        ["flatten_coords", "unflatten_coords", "save_dataset", "load_dataset"],
+        "dataset",
+    ),
+    **dict.fromkeys(
+        [
+            "OFFER_FIELDS",
+            "MAX_LIMIT",
+            "QueryError",
+            "OfferIndex",
+            "make_offer_server",
+            "serve_offers",
+        ],
+        "query_service",
+    ),
+    **dict.fromkeys(
+        [
+            "PRICE_BANDS",
+            "KmlWriter",
+            "kml_region",
+            "write_points",
+            "price_band",
+            "save_apartments_kml",
+            "save_places_kml",
+            "save_coords_kml",
+        ],
+        "kml_export",
+    ),
+    **dict.fromkeys(
+        [
+            "FLOOR_SIZE_TOLERANCE",
+            "PRICE_TOLERANCE",
+            "TITLE_SIMILARITY",
+            "location_keys",
+            "near_duplicate_groups",
+            "dedup_listings",
+            "unique_locations",
+            "fan_out",
+        ],
+        "dedup",
+    ),
+}
+
+__all__ = ["metrics", *_EXPORTS]
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *__all__})
@@ -0,0 +1,241 @@
+import json
+import os
+
+import numpy as np
+
+from . import metrics
+from .ammenities_table import AmmenitiesTable
+from .spatial import EARTH_RADIUS_M
+
+# radii in meters the counts of places around every grid node are kept for
+DEFAULT_RADII = (500, 1000)
+
+
+class AccessibilityGrid:
+
+    """
+    per ammenity type, the distance in meters to the nearest place and the
+    number of places within each of `radii`, precomputed on the nodes of a
+    regular lat/lng grid, so the features of any number of listings are an
+    array lookup instead of a spatial query each
+
+    `distance` is a (types, rows, cols) float32 array (rendered by
+    `save_heatmap_kml`), `counts` a (types, radii, rows, cols) uint16 one;
+    node (i, j) is at origin + (i * step[0], j * step[1])
+
+    `save`/`load` keep the arrays as .npy files that are memory mapped back in
+    """
+
+    def __init__(
+        self,
+        distance: np.ndarray,
+        counts: np.ndarray,
+        origin: tuple[float, float],
+        step: tuple[float, float],
+        types: list[str],
+        radii: tuple[int, ...] = DEFAULT_RADII,
+        cell_size: float | None = None,
+    ):
+        """
+        :param cell_size: meters between the nodes the grid was built with,
+        None if unknown
+        """
+        self.distance = distance
+        self.counts = counts
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.step = np.asarray(step, dtype=np.float64)
+        self.types = list(types)
+        self.radii = tuple(radii)
+        self.cell_size = cell_size
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.distance.shape[1:]  # type: ignore
+
+    @property
+    def bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        ([lat, lng] of the south-west node, [lat, lng] of the north-east one)
+        """
+        return self.origin, self.origin + (np.array(self.shape) - 1) * self.step
+
+    def covers(self, coords) -> bool:
+        south_west, north_east = self.bounds
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        return bool(((coords >= south_west) & (coords <= north_east)).all())
+
+    @classmethod
+    def build(
+        cls,
+        table: AmmenitiesTable,
+        coords,
+        cell_size: float = 100,
+        radii: tuple[int, ...] = DEFAULT_RADII,
+        margin: float = 1_000,
+        path: str | None = None,
+    ) -> "AccessibilityGrid":
+        """
+        :param table: the places, one layer per type of the table
+        :param coords: (N, 2) [lat, lng] the grid has to cover, e.g. the
+        apartments
+        :param cell_size: distance between the grid nodes in meters
+        :param margin: meters the grid extends past the coords
+        :param path: write the arrays straight into .npy files in path (and
+        return them memory mapped) instead of keeping them in memory
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        lat_step = np.degrees(cell_size / EARTH_RADIUS_M)
+        lng_step = lat_step / np.cos(np.radians(coords[:, 0].mean()))
+        step = np.array([lat_step, lng_step])
+        margin_steps = np.ceil(margin / cell_size)
+        origin = coords.min(axis=0) - margin_steps * step
+        rows, cols = (
+            np.ceil((coords.max(axis=0) - origin) / step) + margin_steps + 1
+        ).astype(int).tolist()
+        shape = (len(table.types), rows, cols)
+        counts_shape = (len(table.types), len(radii), rows, cols)
+
+        if path is None:
+            distance = np.empty(shape, dtype=np.float32)
+            counts = np.empty(counts_shape, dtype=np.uint16)
+        else:
+            os.makedirs(path, exist_ok=True)
+            distance = np.lib.format.open_memmap(
+                os.path.join(path, "distance.npy"), mode="w+",
+                dtype=np.float32, shape=shape)
+            counts = np.lib.format.open_memmap(
+                os.path.join(path, "counts.npy"), mode="w+",
+                dtype=np.uint16, shape=counts_shape)
+
+        lat, lng = np.meshgrid(
+            origin[0] + np.arange(rows) * lat_step,
+            origin[1] + np.arange(cols) * lng_step,
+            indexing="ij",
+        )
+        nodes = np.column_stack([lat.ravel(), lng.ravel()])
+        with metrics.stage("accessibility_grid", items=len(nodes) * len(table.types)):
+            for t, ammenity in enumerate(table.types):
+                view = table.view(ammenity)
+                if not len(view):
+                    distance[t] = np.inf
+                    counts[t] = 0
+                    continue
+                _, nearest = view.index.nearest(nodes)
+                distance[t] = nearest.reshape(rows, cols)
+                for r, radius in enumerate(radii):
+                    counts[t, r] = np.minimum(
+                        view.index.count_within_radius(nodes, radius),
+                        np.iinfo(np.uint16).max,
+                    ).reshape(rows, cols)
+
+        grid = cls(distance, counts, origin, step, table.types, radii, cell_size)
+        if path is not None:
+            distance.flush()  # type: ignore
+            counts.flush()  # type: ignore
+            grid._save_meta(path)
+        return grid
+
+    def count_at(self, coords, ammenity: str, radius: int) -> np.ndarray:
+        """
+        number of places of the type within radius of the nearest grid node,
+        NaN outside of the grid
+
+        :param coords: (N, 2) [lat, lng]
+        :param radius: one of `radii`
+        """
+        layer = self.counts[self.types.index(ammenity), self.radii.index(radius)]
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        position = (coords - self.origin) / self.step
+        rows, cols = self.shape
+        outside = (
+            (position < 0).any(axis=1)
+            | (position[:, 0] > rows - 1)
+            | (position[:, 1] > cols - 1)
+        )
+        i, j = np.rint(position).astype(int).T
+        values = layer[np.clip(i, 0, rows - 1), np.clip(j, 0, cols - 1)]
+        values = values.astype(np.float64)
+        values[outside] = np.nan
+        return values
+
+    def _save_meta(self, path: str):
+        with open(os.path.join(path, "meta.json"), "w+") as f:
+            json.dump(
+                {
+                    "origin": self.origin.tolist(),
+                    "step": self.step.tolist(),
+                    "types": self.types,
+                    "radii": list(self.radii),
+                    "cell_size": self.cell_size,
+                },
+                f,
+            )
+
+    def save(self, path: str = "accessibility_grid"):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "distance.npy"), self.distance)
+        np.save(os.path.join(path, "counts.npy"), self.counts)
+        self._save_meta(path)
+
+    @classmethod
+    def load(cls, path: str = "accessibility_grid", mmap: bool = True) -> "AccessibilityGrid":
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        return cls(
+            distance=np.load(os.path.join(path, "distance.npy"), mmap_mode=mmap_mode),
+            counts=np.load(os.path.join(path, "counts.npy"), mmap_mode=mmap_mode),
+            origin=meta["origin"],
+            step=meta["step"],
+            types=meta["types"],
+            radii=tuple(meta["radii"]),
+            cell_size=meta.get("cell_size"),
+        )
+
+    def save_heatmap_kml(
+        self,
+        file_name: str,
+        ammenity: str,
+        radius: int | None = None,
+        max_distance: float = 2_000,
+    ):
+        """
+        renders a layer as a PNG ground overlay, file_name.kml next to
+        file_name.png
+
+        :param radius: render the counts within the radius instead of the
+        distance to the nearest place
+        :param max_distance: distance where the distance colour scale tops out
+        """
+        import matplotlib.pyplot as plt
+
+        from .kml_export import KmlWriter
+
+        t = self.types.index(ammenity)
+        if radius is None:
+            # close is good, so close is the hot end of the scale
+            image = np.clip(self.distance[t], 0, max_distance)
+            vmin, vmax, cmap = 0, max_distance, "inferno_r"
+        else:
+            image = self.counts[t, self.radii.index(radius)]
+            vmin, vmax, cmap = 0, max(1, int(image.max())), "inferno"
+        # rows go south to north, images top to bottom
+        image_path = file_name + ".png"
+        plt.imsave(image_path, image[::-1], vmin=vmin, vmax=vmax, cmap=cmap)
+
+        south_west, north_east = self.bounds
+        half_step = self.step / 2
+        file_path = file_name + ".kml"
+        with open(file_path, "w+", encoding="utf-8") as f, \
+                KmlWriter(f, ammenity) as kml:
+            kml.ground_overlay(
+                ammenity,
+                os.path.basename(image_path),
+                south=south_west[0] - half_step[0],
+                west=south_west[1] - half_step[1],
+                north=north_east[0] + half_step[0],
+                east=north_east[1] + half_step[1],
+                color="b0ffffff",  # ~70% opaque
+            )
+
+        print(f"KML file saved at: {file_path}")
@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from .spatial import SpatialIndex
+
+# the columns `AmmenitiesTable.save` writes as .npy files, place_id and name
+# are fixed-width unicode so they can be memory mapped too
+COLUMNS = ["place_id", "name", "codes", "coords", "rating"]
+
+
+class AmmenitiesTable:
+
+    """
+    columnar version of the ammenities cache: place ids, names, a (N, 2)
+    float64 array of [lat, lng], ratings and the ammenity type as categorical
+    codes into `types`
+
+    rows are sorted by type, so `view(ammenity)` is a zero-copy slice of every
+    column, and `save`/`load` keep the columns as .npy files that are memory
+    mapped back in
+    """
+
+    def __init__(
+        self,
+        place_id: np.ndarray,
+        name: np.ndarray,
+        codes: np.ndarray,
+        coords: np.ndarray,
+        rating: np.ndarray,
+        types: list[str],
+        offsets: np.ndarray | None = None,
+    ):
+        self.place_id = place_id
+        self.name = name
+        self.codes = codes
+        self.coords = coords
+        self.rating = rating
+        self.types = types
+        if offsets is None:
+            offsets = np.searchsorted(codes, np.arange(len(types) + 1))
+        self._offsets = offsets
+        self._index: SpatialIndex | None = None
+
+    @classmethod
+    def from_cache(
+        cls,
+        ammenities_cache: dict[str, dict[str, dict]],
+        types: list[str] | None = None,
+    ) -> "AmmenitiesTable":
+        """
+        :param ammenities_cache: HowCloseIsItService.ammenities_cache
+        :param types: ammenity types to include (and their order), all of the
+        types in the cache by default
+        """
+        types = list(types or ammenities_cache.keys())
+        places = [
+            (code, place)
+            for code, ammenity in enumerate(types)
+            for place in ammenities_cache.get(ammenity, {}).values()
+        ]
+        return cls(
+            place_id=np.array([p["place_id"] for _, p in places], dtype=str),
+            name=np.array([p["name"] for _, p in places], dtype=str),
+            codes=np.array([code for code, _ in places], dtype=np.int16),
+            coords=np.array(
+                [p["coords"] for _, p in places],
+                dtype=np.float64,
+            ).reshape(-1, 2),
+            rating=np.array(
+                [p.get("rating", np.nan) for _, p in places],
+                dtype=np.float64,
+            ),
+            types=types,
+        )
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def lat(self) -> np.ndarray:
+        return self.coords[:, 0]
+
+    @property
+    def lon(self) -> np.ndarray:
+        return self.coords[:, 1]
+
+    @property
+    def ammenity(self) -> pd.Categorical:
+        return pd.Categorical.from_codes(self.codes, categories=self.types)
+
+    def _take(self, rows: slice | np.ndarray) -> "AmmenitiesTable":
+        return AmmenitiesTable(
+            place_id=self.place_id[rows],
+            name=self.name[rows],
+            codes=self.codes[rows],
+            coords=self.coords[rows],
+            rating=self.rating[rows],
+            types=self.types,
+        )
+
+    def view(self, ammenity: str) -> "AmmenitiesTable":
+        """
+        the rows of one ammenity type, slices of the columns (no copy)
+        """
+        code = self.types.index(ammenity)
+        return self._take(slice(self._offsets[code], self._offsets[code + 1]))
+
+    def filter(self, mask: np.ndarray) -> "AmmenitiesTable":
+        """
+        the rows where mask is True, e.g. `table.filter(table.rating >= 4)`
+        """
+        return self._take(np.asarray(mask, dtype=bool))
+
+    @property
+    def index(self) -> SpatialIndex:
+        """
+        spatial index over the coords, built on first use
+        """
+        if self._index is None:
+            self._index = SpatialIndex(self.coords)
+        return self._index
+
+    def to_df(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "place_id": self.place_id,
+                "name": self.name,
+                "ammenity": self.ammenity,
+                "lat": self.lat,
+                "lon": self.lon,
+                "rating": self.rating,
+            }
+        )
+
+    def save(self, path: str = "ammenities_table"):
+        os.makedirs(path, exist_ok=True)
+        for column in COLUMNS:
+            np.save(os.path.join(path, f"{column}.npy"), getattr(self, column))
+        with open(os.path.join(path, "types.txt"), "w+") as f:
+            f.write("\n".join(self.types))
+
+    @classmethod
+    def load(cls, path: str = "ammenities_table", mmap: bool = True) -> "AmmenitiesTable":
+        mmap_mode = "r" if mmap else None
+        columns = {
+            column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode=mmap_mode)
+            for column in COLUMNS
+        }
+        with open(os.path.join(path, "types.txt")) as f:
+            types = f.read().splitlines()
+        return cls(**columns, types=types)
@@ -0,0 +1,98 @@
+import heapq
+
+import numpy as np
+
+from .spatial import EARTH_RADIUS_M, SpatialIndex, haversine
+
+
+def grid_cells(coords, cell_size: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    snaps [lat, lng] coordinates to a grid of roughly cell_size x cell_size
+    meter cells
+
+    :param cell_size: side of a cell in meters
+    :return: (centers, counts, spread), the mean [lat, lng] of the
+    coordinates in every occupied cell, how many of them there are and the
+    largest distance in meters from the mean to one of them
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    lat_step = np.degrees(cell_size / EARTH_RADIUS_M)
+    lng_step = lat_step / np.cos(np.radians(np.median(coords[:, 0])))
+    cells = np.floor(coords / [lat_step, lng_step]).astype(np.int64)
+    _, inverse, counts = np.unique(
+        cells, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    centers = np.zeros((len(counts), 2))
+    np.add.at(centers, inverse, coords)
+    centers /= counts[:, None]
+    spread = np.zeros(len(counts))
+    np.maximum.at(spread, inverse, haversine(coords, centers[inverse]))
+    return centers, counts, spread
+
+
+def plan_search_centers(
+    coords,
+    radius: float = 10_000,
+    searched=None,
+    cell_size: float | None = None,
+) -> np.ndarray:
+    """
+    picks as few places search centers as it can so that every one of the
+    coordinates is within radius of one of them
+
+    the coordinates are snapped to a grid first (see `grid_cells`), which
+    keeps it fast for hundreds of thousands of listings, and the cells are
+    then covered greedily: the next center is always the cell center that
+    covers the most not yet covered coordinates; a cell only counts as
+    covered when all of its coordinates are within radius
+
+    :param coords: (N, 2) [lat, lng] of e.g. the apartments
+    :param radius: radius of the places search in meters
+    :param searched: centers already searched around, the coordinates within
+    radius of them are covered from the start
+    :param cell_size: grid cell side in meters, radius / 8 by default
+    :return: (K, 2) array of [lat, lng] centers, largest coverage first,
+    empty if there is nothing left to cover
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if not len(coords):
+        return np.empty((0, 2))
+    centers, counts, spread = grid_cells(coords, cell_size or radius / 8)
+
+    uncovered = counts.astype(np.float64)
+    searched = np.asarray(searched if searched is not None else [],
+                          dtype=np.float64).reshape(-1, 2)
+    if len(searched):
+        _, distances = SpatialIndex(searched).nearest(centers)
+        uncovered[distances + spread <= radius] = 0
+    if not uncovered.any():
+        return np.empty((0, 2))
+
+    # the cells every candidate center covers, candidates are the centers of
+    # the cells that still have something to cover
+    candidates = np.flatnonzero(uncovered)
+    indices, distances = SpatialIndex(centers).within_radius(
+        centers[candidates], radius)
+    covers = [
+        cells[cell_distances + spread[cells] <= radius]
+        for cells, cell_distances in zip(indices, distances)
+    ]
+
+    # lazy greedy, the gain of a candidate only ever goes down, so a
+    # candidate whose recomputed gain still beats the next best is the best
+    heap = [(-uncovered[cells].sum(), i) for i, cells in enumerate(covers)]
+    heapq.heapify(heap)
+    picked = []
+    remaining = uncovered.sum()
+    while heap and remaining:
+        _, i = heapq.heappop(heap)
+        gain = uncovered[covers[i]].sum()
+        if not gain:
+            continue
+        if heap and gain < -heap[0][0]:
+            heapq.heappush(heap, (-gain, i))
+            continue
+        picked.append(candidates[i])
+        uncovered[covers[i]] = 0
+        remaining -= gain
+    return centers[picked]
@@ -2,32 +2,23 @@ import pandas as pd
 import math
 import numpy as np
 
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
+from . import metrics
 
 
-def run_preds(df: pd.DataFrame):
-    X = df[["floor_size", "number_of_rooms"]].to_numpy()
-    y = df["price"].to_numpy()
+@metrics.timed("run_preds")
+def run_preds(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    cross-validated comparison of the MODELS of lib.modelling on the
+    enriched listings
 
-    # Step 2: Train-Test Split
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.1)
+    :return: see `compare_models`
+    """
+    # sklearn and joblib are only imported by the callers that model
+    from .modelling import compare_models
 
-    print(X_train.shape, y_train.shape)
-
-    # Step 3: Model Training
-    model = LinearRegression()
-    model.fit(X_train, y_train)
-
-    # Step 4: Model Evaluation
-    y_pred = model.predict(X_test)
-    print(
-        f"Root Mean Squared Error: {mean_squared_error(y_test, y_pred, squared=False)}"
-    )
+    scores = compare_models(df)
+    print(scores[[("rmse", "mean"), ("mape", "mean"), ("r2", "mean")]])
+    return scores
 
 
 def euclidean_distance(coord1: np.ndarray, coord2: np.ndarray):
@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from . import metrics
+
+
+def _is_coords_column(df: pd.DataFrame, column: str) -> bool:
+    # already flattened frames (e.g. from `load_dataset`) have float columns
+    return (
+        column == "coords" or column.startswith("closest_")
+    ) and df[column].dtype == object
+
+
+def flatten_coords(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    splits every column of [lat, lng] lists (`coords`, `closest_*`) into
+    float64 `<column>_lat` and `<column>_lon` columns
+    """
+    df = df.copy()
+    for column in [c for c in df.columns if _is_coords_column(df, c)]:
+        values = df.pop(column)
+        coords = np.full((len(values), 2), np.nan)
+        present = values.notna().to_numpy()
+        if present.any():
+            coords[present] = np.array(values[present].tolist(), dtype=np.float64)
+        df[f"{column}_lat"] = coords[:, 0]
+        df[f"{column}_lon"] = coords[:, 1]
+    return df
+
+
+def unflatten_coords(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    the inverse of `flatten_coords`, for code that expects the list columns
+    """
+    df = df.copy()
+    for lat_column in [c for c in df.columns if c.endswith("_lat")]:
+        column = lat_column[:-len("_lat")]
+        lon_column = f"{column}_lon"
+        if lon_column not in df:
+            continue
+        df[column] = [
+            None if np.isnan(lat) else [lat, lon]
+            for lat, lon in zip(df.pop(lat_column), df.pop(lon_column))
+        ]
+    return df
+
+
+def save_dataset(
+    df: pd.DataFrame,
+    path: str = "final_df.parquet",
+    partition_cols: list[str] | None = None,
+):
+    """
+    writes the enriched listings as Parquet with the coordinates split into
+    numeric columns, see `flatten_coords`
+
+    :param partition_cols: write a hive-partitioned directory instead of a
+    single file, e.g. ["region"]
+    """
+    table = pa.Table.from_pandas(flatten_coords(df), preserve_index=False)
+    if partition_cols:
+        pq.write_to_dataset(
+            table,
+            path,
+            partition_cols=partition_cols,
+            existing_data_behavior="delete_matching",
+        )
+    else:
+        tmp_path = path + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    metrics.count("dataset.bytes_written", _size(path))
+    print(f"dataset saved at: {path}")
+
+
+def load_dataset(
+    path: str = "final_df.parquet",
+    columns: list[str] | None = None,
+    filters: list | None = None,
+    memory_map: bool = True,
+    flat: bool = True,
+) -> pd.DataFrame:
+    """
+    reads back what `save_dataset` wrote, only the given columns and the row
+    groups/partitions matching the filters are read
+
+    ```Python
+    load_dataset(
+        columns=["price", "price_per_m2", "distance_to_closest_skm"],
+        filters=[("price", "<=", 500_000)],
+    )
+    ```
+
+    :param filters: pyarrow filters, e.g. [("region", "=", "pomorskie_sopot_sopot_sopot")]
+    :param memory_map: memory map the file(s) instead of reading them in
+    :param flat: keep the coordinates as `<column>_lat`/`<column>_lon`, the
+    list columns of the old final_df.pkl are rebuilt if False
+    """
+    table = pq.read_table(
+        path,
+        columns=columns,
+        filters=filters,
+        memory_map=memory_map,
+    )
+    df = table.to_pandas()
+    return df if flat else unflatten_coords(df)
+
+
+def _size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
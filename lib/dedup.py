@@ -0,0 +1,180 @@
+import difflib
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from . import metrics
+from .geocoding import normalize_address
+
+# near-duplicates are listings at the same normalized address whose floor
+# sizes, prices and titles are at least this close
+FLOOR_SIZE_TOLERANCE = 1.0  # m2
+PRICE_TOLERANCE = 0.02  # relative
+TITLE_SIMILARITY = 0.85  # difflib ratio
+
+
+def location_keys(addresses: pd.Series) -> np.ndarray:
+    """
+    8-byte hash of the normalized address (see `normalize_address`) of every
+    listing, listings with the same key geocode to the same coords; 0 for
+    listings without an address
+    """
+    keys = {
+        address: int.from_bytes(
+            hashlib.blake2b(normalize_address(address).encode(), digest_size=8)
+            .digest(), "little")
+        for address in addresses.dropna().unique()
+    }
+    return addresses.map(keys).fillna(0).to_numpy(dtype=np.uint64)
+
+
+def _find(parents: np.ndarray, i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def _is_near_duplicate(
+    a: int,
+    b: int,
+    price: np.ndarray,
+    titles: list[str],
+    price_tolerance: float,
+    title_similarity: float,
+) -> bool:
+    if np.isnan(price[a]) != np.isnan(price[b]):
+        return False
+    if not np.isnan(price[a]) and \
+            abs(price[a] - price[b]) > price_tolerance * max(price[a], price[b]):
+        return False
+    return difflib.SequenceMatcher(
+        None, titles[a], titles[b]).ratio() >= title_similarity
+
+
+def near_duplicate_groups(
+    df: pd.DataFrame,
+    floor_size_tolerance: float = FLOOR_SIZE_TOLERANCE,
+    price_tolerance: float = PRICE_TOLERANCE,
+    title_similarity: float = TITLE_SIMILARITY,
+) -> np.ndarray:
+    """
+    groups the listings that are the same flat listed more than once, e.g.
+    by different agencies or as separate units of a development
+
+    only listings at the same location (see `location_keys`) are compared,
+    sorted by floor size so every listing is only compared to the ones
+    within floor_size_tolerance of it
+
+    :return: position of the first listing of its group for every listing
+    """
+    n = len(df)
+    parents = np.arange(n)
+    locations = location_keys(df["address"].astype(object))
+    floor_size = df["floor_size"].to_numpy(dtype=np.float64, na_value=np.nan)
+    price = df["price"].to_numpy(dtype=np.float64, na_value=np.nan)
+    titles = [
+        " ".join(str(title).lower().split()) for title in df["title"].tolist()]
+
+    order = np.lexsort((floor_size, locations))
+    for start, i in enumerate(order):
+        for j in order[start + 1:]:
+            if not locations[i] or locations[j] != locations[i] \
+                    or not floor_size[j] - floor_size[i] <= floor_size_tolerance:
+                break
+            if _is_near_duplicate(
+                    i, j, price, titles, price_tolerance, title_similarity):
+                root_i, root_j = _find(parents, i), _find(parents, j)
+                # the first listing is the root, so it represents the group
+                parents[max(root_i, root_j)] = min(root_i, root_j)
+    return np.array([_find(parents, i) for i in range(n)], dtype=np.intp)
+
+
+@metrics.timed("dedup", items=len)
+def dedup_listings(df: pd.DataFrame, **tolerances) -> pd.DataFrame:
+    """
+    drops the exact duplicates (same id or url, i.e. the same listing seen on
+    more than one page) and adds
+
+    - `duplicate_of`, id of the first listing that is the same flat, see
+    `near_duplicate_groups`, the listing's own id if it's the first; ids
+    rather than index labels, so they still hold after `merge_delta`
+    - `location_of`, index of the first listing at the same location, the
+    only one `unique_locations` keeps for enrichment
+
+    :param df: preprocessed listings
+    :param tolerances: of `near_duplicate_groups`
+    """
+    unique = ~df["id"].duplicated()
+    if "url" in df:
+        unique &= ~df["url"].duplicated()
+    exact_duplicates = int((~unique).sum())
+    df = df[unique].copy()
+    if df.empty:
+        df["duplicate_of"] = df["id"].to_numpy()
+        df["location_of"] = df.index.to_numpy()
+        return df
+
+    index = df.index.to_numpy()
+    ids = df["id"].to_numpy()
+    df["duplicate_of"] = ids[near_duplicate_groups(df, **tolerances)]
+    locations = location_keys(df["address"].astype(object))
+    location_of = pd.Series(index, index=df.index).groupby(
+        locations, sort=False).transform("first").to_numpy()
+    # listings without an address are their own location
+    df["location_of"] = np.where(locations == 0, index, location_of)
+
+    near_duplicates = int((df["duplicate_of"] != df["id"]).sum())
+    metrics.count("dedup.exact_duplicates", exact_duplicates)
+    metrics.count("dedup.near_duplicates", near_duplicates)
+    print(
+        f"duplicates: {exact_duplicates} exact (dropped), {near_duplicates} "
+        f"near, {len(df)} listings at {df['location_of'].nunique()} locations"
+    )
+    return df
+
+
+def unique_locations(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    one listing per location of a `dedup_listings` frame
+    """
+    return df[df["location_of"] == df.index]
+
+
+def fan_out(
+    enriched: pd.DataFrame,
+    listings: pd.DataFrame,
+    distances_per_listing: int | None = None,
+) -> pd.DataFrame:
+    """
+    copies the columns enrichment added to the unique locations to every
+    listing at the location, listings whose location was dropped during
+    enrichment (e.g. too far from the center) are dropped too
+
+    :param enriched: `unique_locations(listings)` after enrichment
+    :param listings: the `dedup_listings` frame
+    :param distances_per_listing: distance matrix elements the enrichment
+    computes per listing, for the report of the requests avoided; the
+    distance to the center and to every closest ammenity by default
+    :return: listings with the enriched columns, without `location_of`
+    """
+    added = [column for column in enriched.columns if column not in listings]
+    df = listings[listings["location_of"].isin(enriched.index)].copy()
+    representatives = enriched.loc[df["location_of"]]
+    for column in added:
+        df[column] = representatives[column].to_numpy()
+
+    if distances_per_listing is None:
+        distances_per_listing = 1 + sum(
+            column.startswith("distance_to_closest_") for column in added)
+    avoided = len(listings) - len(unique_locations(listings))
+    metrics.count("dedup.avoided_geocodes", avoided)
+    metrics.count("dedup.avoided_distance_elements", avoided * distances_per_listing)
+    print(
+        f"dedup avoided {avoided} geocodes and "
+        f"{avoided * distances_per_listing} distance elements, enriched "
+        f"{len(enriched)} locations for {len(df)} listings "
+        f"({1 - len(enriched) / max(len(df), 1):.0%} less enrichment work)"
+    )
+    return df.drop(columns="location_of")
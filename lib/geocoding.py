@@ -0,0 +1,277 @@
+import json
+import os
+import re
+import unicodedata
+
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any
+
+import googlemaps
+
+from . import metrics
+from .kv_store import KVStore
+
+GeocodeResponse = list[dict]
+
+# types of Google geocode results that are no more precise than a street,
+# an address that resolves to one of those resolves to the same place from
+# the gazetteer
+COARSE_RESULT_TYPES = {
+    "route",
+    "neighborhood",
+    "sublocality",
+    "locality",
+    "administrative_area_level_3",
+}
+
+_STREET_PREFIXES = re.compile(r"\b(ul|al|pl|os|aleja|ulica|plac|osiedle)\b\.?")
+_NON_WORD = re.compile(r"[^\w,]+")
+
+
+def normalize_address(address: str) -> str:
+    """
+    key under which differently spelled versions of the same address meet:
+    lowercased, without diacritics, street prefixes (ul., al., ...),
+    punctuation or repeated whitespace, with the comma-separated parts
+    deduplicated and sorted
+
+    "Gdańsk, Jelitkowo, ul. Pomorska" and "pomorska,  GDANSK, Jelitkowo" both
+    become "gdansk, jelitkowo, pomorska"
+    """
+    address = address.lower().replace("ł", "l")
+    address = unicodedata.normalize("NFKD", address)
+    address = "".join(c for c in address if not unicodedata.combining(c))
+    address = _STREET_PREFIXES.sub(" ", address)
+    address = _NON_WORD.sub(" ", address)
+    parts = {" ".join(part.split()) for part in address.split(",")}
+    return ", ".join(sorted(part for part in parts if part))
+
+
+def coords_response(lat: float, lng: float, source: str) -> GeocodeResponse:
+    """
+    a minimal geocode response for a locally resolved address, shaped like
+    Google's so `HowCloseIsItService.response_to_coords` works on it
+    """
+    return [
+        {
+            "geometry": {"location": {"lat": lat, "lng": lng}},
+            "types": ["approximate"],
+            "source": source,
+        }
+    ]
+
+
+class GeocodingBackend(ABC):
+
+    """
+    something that turns an address (and optionally the otodom item it comes
+    from) into a geocode response, or None if it can't
+    """
+
+    name = "backend"
+
+    @abstractmethod
+    def geocode(
+        self,
+        address: str,
+        item: dict | None = None,
+    ) -> GeocodeResponse | None:
+        ...
+
+    def remember(self, address: str, response: GeocodeResponse):
+        """
+        called with the answers of the backends later in the chain
+        """
+
+
+class CacheGeocoder(GeocodingBackend):
+
+    """
+    the geocode cache, looked up by the raw address first and then by its
+    `normalize_address` key
+    """
+
+    name = "cache"
+
+    def __init__(self, cache: KVStore):
+        self._cache = cache
+        self._normalized: dict[str, str] | None = None
+
+    def _normalized_index(self) -> dict[str, str]:
+        if self._normalized is None:
+            self._normalized = {
+                normalize_address(key): key for key in self._cache.keys()
+            }
+        return self._normalized
+
+    def geocode(self, address, item=None):
+        if address in self._cache:
+            return self._cache[address]
+        key = self._normalized_index().get(normalize_address(address))
+        if key is not None:
+            return self._cache[key]
+        return None
+
+    def remember(self, address, response):
+        if response and response[0].get("source") is None:
+            self._cache[address] = response
+            self._normalized_index()[normalize_address(address)] = address
+
+
+class GazetteerGeocoder(GeocodingBackend):
+
+    """
+    resolves street-, district- and city-level addresses offline
+
+    the gazetteer is built from the street-level (or coarser) answers already
+    in the geocode cache, plus an optional JSON file of {name: [lat, lng]};
+    addresses with a house number are left to the more precise backends
+    """
+
+    name = "gazetteer"
+
+    def __init__(
+        self,
+        cache: KVStore | None = None,
+        gazetteer_path: str = "gazetteer.json",
+    ):
+        self._cache = cache
+        self.gazetteer_path = gazetteer_path
+        self._places: dict[str, list[float]] | None = None
+
+    @property
+    def places(self) -> dict[str, list[float]]:
+        if self._places is None:
+            self._places = {}
+            if self._cache is not None:
+                for _, response in self._cache.items():
+                    self.remember("", response)
+            if os.path.exists(self.gazetteer_path):
+                with open(self.gazetteer_path) as f:
+                    for name, coords in json.load(f).items():
+                        self._places[normalize_address(name)] = coords
+        return self._places
+
+    @staticmethod
+    def _place_name(result: dict) -> str | None:
+        components = {
+            component_type: component["long_name"]
+            for component in result.get("address_components", [])
+            for component_type in component["types"]
+        }
+        locality = components.get("locality")
+        if locality is None:
+            return None
+        for component_type in ("route", "neighborhood", "sublocality"):
+            if component_type in result["types"]:
+                return f"{components[component_type]}, {locality}"
+        return locality
+
+    def _candidates(self, address: str, item: dict | None) -> list[str]:
+        # otodom labels look like "City, District, ..., Street"
+        parts = [part.strip() for part in address.split(",")]
+        if any(c.isdigit() for c in parts[-1]):
+            return []
+
+        if item is not None and item.get("location"):
+            address_details = item["location"]["address"]
+            city = address_details["city"]["name"]
+            street_details = address_details.get("street") or {}
+            street = street_details.get("name")
+            if street_details.get("number"):
+                return []
+            if street:
+                if any(c.isdigit() for c in street):
+                    return []
+                return [f"{street}, {city}"]
+            reverse_geocoding = item["location"].get("reverseGeocoding") or {}
+            locations = reverse_geocoding.get("locations") or []
+            # the last location is the most specific, e.g.
+            # "Jelitkowo, Gdańsk, pomorskie"
+            return [
+                ", ".join(location["fullName"].split(", ")[:2])
+                for location in locations[::-1]
+            ]
+
+        return [f"{parts[-1]}, {parts[0]}"]
+
+    def geocode(self, address, item=None):
+        for candidate in self._candidates(address, item):
+            coords = self.places.get(normalize_address(candidate))
+            if coords is not None:
+                return coords_response(*coords, source=self.name)
+        return None
+
+    def remember(self, address, response):
+        if not response or self._places is None:
+            return
+        result = response[0]
+        if not COARSE_RESULT_TYPES.intersection(result.get("types", [])):
+            return
+        name = self._place_name(result)
+        if name is None:
+            return
+        location = result["geometry"]["location"]
+        self._places.setdefault(
+            normalize_address(name),
+            [location["lat"], location["lng"]],
+        )
+
+
+class GoogleGeocoder(GeocodingBackend):
+
+    name = "google"
+
+    def __init__(self, gmaps: googlemaps.Client):
+        self.gmaps = gmaps
+
+    def geocode(self, address, item=None):
+        return self.gmaps.geocode(address) or None  # type: ignore
+
+
+class GeocoderChain:
+
+    """
+    asks the backends in order and returns the first answer, which is then
+    handed to the `remember` of the backends before it (so a Google answer
+    ends up in the cache and the gazetteer)
+
+    `stats` counts the answers per backend, `report` prints the hit rates
+    """
+
+    def __init__(self, backends: list[GeocodingBackend]):
+        self.backends = backends
+        self.stats: Counter = Counter()
+
+    def geocode(
+        self,
+        address: str,
+        item: dict | None = None,
+    ) -> GeocodeResponse | None:
+        for i, backend in enumerate(self.backends):
+            response = backend.geocode(address, item)
+            if response is not None:
+                self.stats[backend.name] += 1
+                metrics.count(f"geocode.{backend.name}")
+                for earlier in self.backends[:i]:
+                    earlier.remember(address, response)
+                return response
+        self.stats["miss"] += 1
+        metrics.count("geocode.miss")
+        return None
+
+    def report(self) -> dict[str, Any]:
+        total = sum(self.stats.values())
+        rates = {
+            name: count / total if total else 0.0
+            for name, count in self.stats.items()
+        }
+        print(
+            f"geocoded {total} addresses: "
+            + ", ".join(
+                f"{name} {count} ({rates[name]:.1%})"
+                for name, count in self.stats.most_common()
+            )
+        )
+        return {"total": total, "counts": dict(self.stats), "rates": rates}
@@ -1,23 +1,96 @@
+import json
 import os
 import pickle
+import re
 import googlemaps
 import hashlib
+import numpy as np
+import heapq
+import time
 
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from itertools import chain
 from typing import Any
 from pprint import pprint
 
+from . import metrics
+from .accessibility import DEFAULT_RADII, AccessibilityGrid
+from .ammenities_table import AmmenitiesTable
+from .kv_store import KVStore
+from .rate_limit import RateLimiter
+from .spatial import DEFAULT_DETOUR_FACTOR, detour_factor, haversine
+from .geocoding import (
+    CacheGeocoder,
+    GazetteerGeocoder,
+    GeocoderChain,
+    GoogleGeocoder,
+)
+
 Coords = list[float]  # [lat, lng]
 
 GeocodeResponse = dict
 
-Cache = dict[str, GeocodeResponse]
+# both caches live in SQLite (see KVStore), the legacy pickles are imported
+# once when the database files are first created
+Cache = KVStore  # address: GeocodeResponse
 
 Ammenity = dict[str, Any]  # place_id: { name, coords, address, rating, ... }
 AmmenitiesCache = dict[str, Ammenity]
 
-# the str is a hash of tuple of coords (origin, dest)
-DistanceCache = dict[str, float]
+# the key is `distance_keys` of (origin, dest), the value is meters; caches
+# from before were keyed by a sha256 of str((origin, dest)), see
+# `HowCloseIsItService.migrate_distance_cache`
+DistanceCache = KVStore
+
+# https://developers.google.com/maps/documentation/distance-matrix/usage-and-billing
+DISTANCE_MATRIX_MAX_ORIGINS = 25
+DISTANCE_MATRIX_MAX_DESTINATIONS = 25
+DISTANCE_MATRIX_MAX_ELEMENTS = 100
+
+# "haversine" is the great-circle distance, "estimate" the great-circle
+# distance times the detour factor, "api" the distance matrix walking distance
+DISTANCE_MODES = ("haversine", "estimate", "api")
+
+# seconds before a places next_page_token becomes valid
+PLACES_NEXT_PAGE_DELAY = 2.0
+
+# meters around the location a places search covers
+PLACES_RADIUS = 10_000
+
+# decimals the coordinates of the distance cache keys are rounded to, 5 is
+# ~1.1m, 4 ~11m
+DISTANCE_KEY_DECIMALS = 5
+
+
+def distance_keys(
+    origins,
+    dests,
+    decimals: int = DISTANCE_KEY_DECIMALS,
+    symmetric: bool = False,
+) -> list[bytes]:
+    """
+    distance cache keys of (origins[i], dests[i]) pairs: the decimals
+    followed by the four coordinates rounded to them, packed as 32-bit ints
+
+    pairs that only differ past the decimals share a key
+
+    :param origins: (N, 2) [lat, lng]
+    :param dests: (N, 2) [lat, lng]
+    :param decimals: at most 7, so the coordinates fit in 32 bits
+    :param symmetric: A->B and B->A share a key
+    :return: N keys of 17 bytes
+    """
+    assert 0 <= decimals <= 7, decimals
+    scale = 10 ** decimals
+    origins = np.rint(np.asarray(origins, dtype=np.float64).reshape(-1, 2) * scale)
+    dests = np.rint(np.asarray(dests, dtype=np.float64).reshape(-1, 2) * scale)
+    if symmetric:
+        swap = (origins[:, 0] > dests[:, 0]) | (
+            (origins[:, 0] == dests[:, 0]) & (origins[:, 1] > dests[:, 1]))
+        origins[swap], dests[swap] = dests[swap], origins[swap]
+    packed = np.hstack([origins, dests]).astype("<i4").tobytes()
+    prefix = bytes([decimals])
+    return [prefix + packed[i:i + 16] for i in range(0, len(packed), 16)]
 
 
 class HowCloseIsItService:
@@ -28,28 +101,114 @@ class HowCloseIsItService:
 
     GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 
-    def __init__(self):
-        self._cache = self._load_cache()
-        self._ammenities_cache: AmmenitiesCache = self._load_ammenities_cache()
-        self._distance_cache: DistanceCache = self._load_distance_cache()
-        self.gmaps = googlemaps.Client(key=self.GOOGLE_MAPS_API_KEY)
+    def __init__(
+        self,
+        gmaps: googlemaps.Client | None = None,
+        distance_mode: str = "api",
+        detour_factor: float = DEFAULT_DETOUR_FACTOR,
+        city: str = "Gdańsk",
+        cache_dir: str = ".",
+        ammenities_dir: str = ".",
+        distance_key_decimals: int = DISTANCE_KEY_DECIMALS,
+        symmetric_distances: bool = True,
+    ):
+        """
+        :param gmaps: client to use instead of a googlemaps.Client built from
+        GOOGLE_MAPS_API_KEY, e.g. a local stub
+        :param distance_mode: default mode of `distance_column`, one of
+        DISTANCE_MODES
+        :param detour_factor: ratio of walking to great-circle distance used
+        by the "estimate" mode, see `calibrate_detour_factor`
+        :param city: the city `city_center` geocodes
+        :param cache_dir: where the geocode and distance caches live, they
+        are safe to share between processes
+        :param ammenities_dir: where the ammenities cache and table live,
+        one per region
+        :param distance_key_decimals: precision of the distance cache keys,
+        see `distance_keys`
+        :param symmetric_distances: reuse the distance of A->B for B->A,
+        close enough for walking distances; part of the distance cache keys,
+        so every service sharing a cache_dir has to use the same setting
+        """
+        assert distance_mode in DISTANCE_MODES, distance_mode
+        self.city = city
+        self.cache_dir = cache_dir
+        self.ammenities_dir = ammenities_dir
+        self._ammenities_cache_path = os.path.join(
+            ammenities_dir, "ammenities_cache.pkl")
+        self._searched_centers_path = os.path.join(
+            ammenities_dir, "searched_centers.json")
+        self.distance_mode = distance_mode
+        self.detour_factor = detour_factor
+        self.distance_key_decimals = distance_key_decimals
+        self.symmetric_distances = symmetric_distances
+        self._has_legacy_distance_keys: bool | None = None
+        # the caches, the client and the geocoder are built on first use, so
+        # constructing the service costs nothing until it is asked something
+        self._gmaps = gmaps
+        self._opened_cache: Cache | None = None
+        self._loaded_ammenities_cache: AmmenitiesCache | None = None
+        self._opened_distance_cache: DistanceCache | None = None
+        self._loaded_searched_centers: dict[str, list[Coords]] | None = None
+        self._geocoder: GeocoderChain | None = None
+        self.distance_stats = {
+            "pairs": 0,
+            "cache_hits": 0,
+            "requests": 0,
+            "elements": 0,
+        }
+
+    @property
+    def gmaps(self) -> googlemaps.Client:
+        if self._gmaps is None:
+            self._gmaps = googlemaps.Client(key=self.GOOGLE_MAPS_API_KEY)
+        return self._gmaps
+
+    @property
+    def geocoder(self) -> GeocoderChain:
+        # Google is only asked for what neither the cache nor the gazetteer
+        # built from it can answer
+        if self._geocoder is None:
+            self._geocoder = GeocoderChain([
+                CacheGeocoder(self._cache),
+                GazetteerGeocoder(self._cache),
+                GoogleGeocoder(self.gmaps),
+            ])
+        return self._geocoder
+
+    @property
+    def _cache(self) -> Cache:
+        if self._opened_cache is None:
+            self._opened_cache = self._load_cache()
+        return self._opened_cache
+
+    @property
+    def _ammenities_cache(self) -> AmmenitiesCache:
+        if self._loaded_ammenities_cache is None:
+            self._loaded_ammenities_cache = self._load_ammenities_cache()
+        return self._loaded_ammenities_cache
+
+    @property
+    def _distance_cache(self) -> DistanceCache:
+        if self._opened_distance_cache is None:
+            self._opened_distance_cache = self._load_distance_cache()
+        return self._opened_distance_cache
 
     @staticmethod
     def _hash(obj: Any) -> str:
         return hashlib.sha256(str(obj).encode()).hexdigest()
 
     def _load_cache(self) -> Cache:
-        if os.path.exists("cache.pkl"):
-            with open("cache.pkl", "rb") as f:
-                cache = pickle.load(f)
-                print(f"Loaded Geocode cache of length: {len(cache)}")
-                return cache
-        else:
-            return {}
+        cache = KVStore(
+            os.path.join(self.cache_dir, "cache.db"),
+            legacy_pickle=os.path.join(self.cache_dir, "cache.pkl"),
+        )
+        print(f"Opened Geocode cache at {cache.path}")
+        return cache
 
     def _load_ammenities_cache(self) -> AmmenitiesCache:
-        if os.path.exists("ammenities_cache.pkl"):
-            with open("ammenities_cache.pkl", "rb") as f:
+        if os.path.exists(self._ammenities_cache_path):
+            with open(self._ammenities_cache_path, "rb") as f:
                 ammenities_cache = pickle.load(f)
                 print(
                     f"Loaded Ammenities cache of length: {len(ammenities_cache)}")
@@ -57,37 +216,120 @@ class HowCloseIsItService:
         else:
             return {}
 
-    def _load_distance_cache(self) -> dict:
-        if os.path.exists("distance_cache.pkl"):
-            with open("distance_cache.pkl", "rb") as f:
-                distance_cache = pickle.load(f)
-                print(
-                    f"Loaded Distance cache of length: {len(distance_cache)}")
-                return distance_cache
-        else:
-            return {}
+    def _load_distance_cache(self) -> DistanceCache:
+        distance_cache = KVStore(
+            os.path.join(self.cache_dir, "distance_cache.db"),
+            legacy_pickle=os.path.join(self.cache_dir, "distance_cache.pkl"),
+        )
+        print(f"Opened Distance cache at {distance_cache.path}")
+        return distance_cache
+
+    def _distance_keys(self, origins: list[Coords], dests: list[Coords]) -> list[bytes]:
+        return distance_keys(
+            origins,
+            dests,
+            decimals=self.distance_key_decimals,
+            symmetric=self.symmetric_distances,
+        )
 
-    def _write_to_distance_cache(self, origin: list[float], dest: list[float], meters: float):
-        self._distance_cache[self._hash((origin, dest,))] = meters
-        with open("distance_cache.pkl", "wb+") as f:
-            pickle.dump(self._distance_cache, f)
+    def _write_to_distance_cache(self, origin: Coords, dest: Coords, meters: float):
+        self._distance_cache[self._distance_keys([origin], [dest])[0]] = meters
 
-    def _get_from_distance_cache(self, origin: list[float], dest: list[float]) -> float:
-        return self._distance_cache[self._hash((origin, dest,))]
+    def _get_from_distance_cache(
+        self,
+        origins: list[Coords],
+        dests: list[Coords],
+    ) -> list[float | None]:
+        """
+        the cached distances of (origins[i], dests[i]) pairs, None where
+        there is none
+        """
+        if not len(origins):
+            return []
+        keys = self._distance_keys(origins, dests)
+        cached = self._distance_cache.get_many(keys)
+        distances = [cached.get(key) for key in keys]
+        if self._legacy_distance_keys_left():
+            for i, key in enumerate(keys):
+                if distances[i] is None:
+                    distances[i] = self._migrate_legacy_distance(
+                        origins[i], dests[i], key)
+        return distances
+
+    def _legacy_distance_keys_left(self) -> bool:
+        if self._has_legacy_distance_keys is None:
+            self._has_legacy_distance_keys = any(
+                isinstance(key, str) for key in self._distance_cache.keys())
+        return self._has_legacy_distance_keys
+
+    def _migrate_legacy_distance(
+        self,
+        origin: Coords,
+        dest: Coords,
+        key: bytes,
+    ) -> float | None:
+        """
+        moves the distance of the pair from its sha256 key to the new one,
+        `get_distances` keyed by str(([origin], [dest])), `get_distance` by
+        str((origin, dest))
+        """
+        origin = [float(x) for x in origin]
+        dest = [float(x) for x in dest]
+        for legacy_key in (
+            self._hash(([origin], [dest])),
+            self._hash((origin, dest)),
+        ):
+            meters = self._distance_cache.get(legacy_key)
+            if meters is not None:
+                self._distance_cache[key] = meters
+                del self._distance_cache[legacy_key]
+                metrics.count("distance.migrated_keys")
+                return meters
+        return None
+
+    def migrate_distance_cache(
+        self,
+        origins: list[Coords],
+        dests: list[Coords],
+    ) -> int:
+        """
+        rekeys the legacy sha256 entries of the distance cache for the given
+        pairs, e.g. every apartment with the city center and with its closest
+        ammenities of a final_df; the hashes can't be reversed, so entries of
+        pairs that are not given stay as they are (and are migrated when the
+        pair is looked up)
 
-    def _is_in_distance_cache(self, origin: list[float], dest: list[float]) -> bool:
-        return self._hash((origin, dest,)) in self._distance_cache
+        :return: number of entries migrated
+        """
+        if not self._legacy_distance_keys_left():
+            return 0
+        keys = self._distance_keys(origins, dests)
+        migrated = sum(
+            self._migrate_legacy_distance(origin, dest, key) is not None
+            for origin, dest, key in zip(origins, dests, keys)
+        )
+        self._distance_cache.flush()
+        left = sum(isinstance(key, str) for key in self._distance_cache.keys())
+        self._has_legacy_distance_keys = bool(left)
+        print(f"migrated {migrated} distance cache entries, {left} legacy entries left")
+        return migrated
 
     def _is_cached(self, key: str) -> bool:
-        return key in self._cache if self._cache is not None else False
+        return key in self._cache
 
     def _get_from_cache(self, key: str) -> GeocodeResponse:
         return self._cache[key]
 
     def _write_to_cache(self, key: str, value: GeocodeResponse):
         self._cache[key] = value
-        with open("cache.pkl", "wb+") as f:
-            pickle.dump(self._cache, f)
+
+    def flush(self):
+        """
+        commits the buffered geocode and distance cache writes
+        """
+        for cache in (self._opened_cache, self._opened_distance_cache):
+            if cache is not None:
+                cache.flush()
 
     def get_all_of_ammenity(
         self,
@@ -98,11 +340,8 @@ class HowCloseIsItService:
     ) -> Ammenity:
         # the coordinates might be useful so that you don't repeat if the coordinates have been used
         # just read-in to go easy on the free-tier
-        if ammenity not in self._ammenities_cache:
-            self._ammenities_cache[ammenity] = {}
-
         if use_cache:
-            return self._ammenities_cache[ammenity]
+            return self._ammenities_cache.setdefault(ammenity, {})
 
         responses = []
         res = self._make_places_request(location=location, ammenity=ammenity)
@@ -139,6 +378,14 @@ class HowCloseIsItService:
             )
         )
 
+        self._merge_places(ammenity, places)
+        self._save_ammenities_cache()
+
+        return self._ammenities_cache[ammenity]
+
+    def _merge_places(self, ammenity: str, places: list[dict]):
+        if ammenity not in self._ammenities_cache:
+            self._ammenities_cache[ammenity] = {}
         for place in places:
             if place["place_id"] in self._ammenities_cache[ammenity]:
                 print(f"Skipping {place['place_id']}")
@@ -148,10 +395,221 @@ class HowCloseIsItService:
                 "ammenity": ammenity,
             }
 
-        with open("ammenities_cache.pkl", "wb+") as f:
+    def _save_ammenities_cache(self):
+        with open(self._ammenities_cache_path, "wb+") as f:
             pickle.dump(self._ammenities_cache, f)
 
-        return self._ammenities_cache[ammenity]
+    @property
+    def _searched_centers(self) -> dict[str, list[Coords]]:
+        if self._loaded_searched_centers is None:
+            self._loaded_searched_centers = {}
+            if os.path.exists(self._searched_centers_path):
+                with open(self._searched_centers_path) as f:
+                    self._loaded_searched_centers = json.load(f)
+            else:
+                self._loaded_searched_centers = self._legacy_searched_centers()
+        return self._loaded_searched_centers
+
+    def _legacy_searched_centers(self) -> dict[str, list[Coords]]:
+        """
+        caches from before searched_centers.json was kept were filled around
+        the centers in clusters.kml, for every cached type
+        """
+        clusters_path = os.path.join(self.ammenities_dir, "clusters.kml")
+        if not os.path.exists(clusters_path):
+            return {}
+        with open(clusters_path) as f:
+            centers = [
+                [float(lat), float(lng)]
+                for lng, lat in re.findall(
+                    r"<coordinates>([-\d.]+),([-\d.]+)", f.read())
+            ]
+        return {ammenity: centers for ammenity in self._ammenities_cache}
+
+    def searched_centers(self, ammenity: str) -> list[Coords]:
+        """
+        locations `fetch_ammenities` has already searched the ammenity around,
+        everything within PLACES_RADIUS of them is in the ammenities cache
+        """
+        return self._searched_centers.get(ammenity, [])
+
+    def _save_searched_centers(self, jobs: list[tuple[str, list[float]]]):
+        # loaded before the file is truncated, even without jobs
+        searched_centers = self._searched_centers
+        for ammenity, location in jobs:
+            centers = searched_centers.setdefault(ammenity, [])
+            if list(location) not in centers:
+                centers.append(list(location))
+        with open(self._searched_centers_path, "w+") as f:
+            json.dump(searched_centers, f)
+
+    def ammenities_table(
+        self,
+        types: list[str] | None = None,
+    ) -> AmmenitiesTable:
+        """
+        columnar version of the ammenities cache, saved next to it and memory
+        mapped from there as long as it is newer than ammenities_cache.pkl
+
+        :param types: ammenity types to include, all cached types by default
+        """
+        types = list(types or self._ammenities_cache.keys())
+        path = os.path.join(self.ammenities_dir, "ammenities_table")
+        types_path = os.path.join(path, "types.txt")
+        if (
+            os.path.exists(types_path)
+            and os.path.exists(self._ammenities_cache_path)
+            and os.path.getmtime(types_path) >= os.path.getmtime(self._ammenities_cache_path)
+        ):
+            table = AmmenitiesTable.load(path)
+            if table.types == types:
+                return table
+        table = AmmenitiesTable.from_cache(self._ammenities_cache, types)
+        table.save(path)
+        return table
+
+    def accessibility_grid(
+        self,
+        coords,
+        types: list[str] | None = None,
+        cell_size: float = 100,
+        radii: tuple[int, ...] = DEFAULT_RADII,
+    ) -> AccessibilityGrid:
+        """
+        `AccessibilityGrid` of the ammenities table covering coords, saved
+        next to the table and memory mapped from there as long as it is newer
+        than the table, was built with the same cell_size and radii and
+        covers all of the coords
+
+        :param types: see `ammenities_table`
+        :param cell_size, radii: see `AccessibilityGrid.build`
+        """
+        table = self.ammenities_table(types)
+        path = os.path.join(self.ammenities_dir, "accessibility_grid")
+        meta_path = os.path.join(path, "meta.json")
+        table_path = os.path.join(self.ammenities_dir, "ammenities_table", "types.txt")
+        if (
+            os.path.exists(meta_path)
+            and os.path.getmtime(meta_path) >= os.path.getmtime(table_path)
+        ):
+            grid = AccessibilityGrid.load(path)
+            if (
+                grid.types == table.types
+                and grid.cell_size == cell_size
+                and grid.radii == tuple(radii)
+                and grid.covers(coords)
+            ):
+                return grid
+        return AccessibilityGrid.build(
+            table, coords, cell_size=cell_size, radii=radii, path=path)
+
+    def fetch_ammenities(
+        self,
+        jobs: list[tuple[str, list[float]]],
+        qps: float = 5.0,
+        workers: int = 8,
+        max_next_pages: int = 10,
+    ) -> AmmenitiesCache:
+        """
+        pages through the places search of every (ammenity, location) job
+        concurrently and merges all of the results into the ammenities cache
+        once at the end, also when a job fails (only the rest of its pages
+        are skipped, it is searched again next time) or the run is
+        interrupted
+
+        a next_page_token only becomes valid a couple of seconds after it is
+        issued, so the next page of a chain is scheduled for later instead of
+        holding a worker, the other chains keep going in the meantime
+
+        :param jobs: list of (ammenity, location)
+        :param qps: places requests per second across all of the jobs
+        :param workers: max number of requests in flight
+        :param max_next_pages: max number of next pages per job, paging seems
+        weird and there is no total count, there are many repeats after ~10
+        :return: the ammenities cache
+        """
+        rate_limiter = RateLimiter(rate=qps, burst=max(1, int(qps)))
+        responses: dict[int, list[dict]] = {i: [] for i in range(len(jobs))}
+        used_tokens: dict[int, set[str]] = {i: set() for i in range(len(jobs))}
+        # (not before, job index, page token)
+        scheduled: list[tuple[float, int, str]] = [
+            (0.0, i, "") for i in range(len(jobs))
+        ]
+        running: dict[Future, int] = {}
+
+        def request(i: int, page_token: str) -> dict:
+            rate_limiter.acquire()
+            ammenity, location = jobs[i]
+            return self._make_places_request(
+                location=location,
+                ammenity=ammenity,
+                page_token=page_token,
+            )
+
+        # jobs whose chain of pages went through to the end
+        finished: set[int] = set()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                while scheduled or running:
+                    now = time.monotonic()
+                    while (
+                        scheduled and scheduled[0][0] <= now and len(running) < workers
+                    ):
+                        _, i, page_token = heapq.heappop(scheduled)
+                        running[executor.submit(request, i, page_token)] = i
+
+                    timeout = max(0.0, scheduled[0][0] - now) if scheduled else None
+                    if not running:
+                        time.sleep(timeout or 0)
+                        continue
+                    done, _ = wait(running, timeout=timeout,
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i = running.pop(future)
+                        try:
+                            res = future.result()
+                        except Exception as e:
+                            # e.g. INVALID_REQUEST for a next_page_token used
+                            # too early, only this chain stops
+                            metrics.count("places.failed_jobs")
+                            print(f"places search for {jobs[i]} failed: {e!r}")
+                            continue
+                        responses[i].append(res)
+                        page_token = res.get("next_page_token")
+                        if (
+                            page_token
+                            and page_token not in used_tokens[i]
+                            and len(responses[i]) <= max_next_pages
+                        ):
+                            used_tokens[i].add(page_token)
+                            heapq.heappush(
+                                scheduled,
+                                (
+                                    time.monotonic() + PLACES_NEXT_PAGE_DELAY,
+                                    i,
+                                    page_token,
+                                ),
+                            )
+                        else:
+                            finished.add(i)
+        finally:
+            # the pages fetched so far are kept even if the run is
+            # interrupted, only the finished jobs count as searched
+            for i, (ammenity, _) in enumerate(jobs):
+                self._merge_places(
+                    ammenity,
+                    list(chain(*[
+                        self._process_places_response(res) for res in responses[i]
+                    ])),
+                )
+            self._save_ammenities_cache()
+            self._save_searched_centers([jobs[i] for i in sorted(finished)])
+            print(
+                f"fetched {sum(len(r) for r in responses.values())} places pages "
+                f"for {len(finished)}/{len(jobs)} jobs"
+            )
+
+        return self._ammenities_cache
 
     def _make_places_request(
         self,
@@ -159,10 +617,11 @@ class HowCloseIsItService:
         ammenity: str = "",
         page_token: str = "",
     ):
+        metrics.count("places.requests")
         res = self.gmaps.places(  # type: ignore
             query=ammenity,
             location=location,
-            radius=10_000,
+            radius=PLACES_RADIUS,
             page_token=page_token,
         )
         if not res["status"] == "ZERO_RESULTS":
@@ -204,15 +663,15 @@ class HowCloseIsItService:
         return results
 
     def city_center(self) -> Coords:
-        return self.response_to_coords(self.geocode("Gdańsk"))
+        return self.response_to_coords(self.geocode(self.city))
 
-    def geocode(self, address: str) -> GeocodeResponse:
-        if self._is_cached(address):
-            return self._get_from_cache(address)
-        geocode_result = self.gmaps.geocode(address)  # type: ignore
-        if geocode_result is not None:
-            self._write_to_cache(address, geocode_result)
-        return geocode_result
+    @metrics.timed("geocode")
+    def geocode(self, address: str, item: dict | None = None) -> GeocodeResponse:
+        """
+        :param item: the otodom item the address comes from, lets the
+        gazetteer use its street and reverse geocoding fields
+        """
+        return self.geocoder.geocode(address, item)  # type: ignore
 
     def get_distance(
         self,
@@ -227,19 +686,206 @@ class HowCloseIsItService:
 
         :return: distance in meters
         """
-        if self._is_in_distance_cache(origin, dest):
-            return self._get_from_distance_cache(origin, dest)
+        meters = self._get_from_distance_cache([origin], [dest])[0]
+        if meters is not None:
+            return meters
+        metrics.count("distance.requests")
+        metrics.count("distance.elements")
         res = self.gmaps.distance_matrix(  # type: ignore
             origins=origin,
             destinations=dest,
             mode=mode,
         )
-        print("sent distance req for ", origin, dest)
         assert res["status"] == "OK", res
         meters = res["rows"][0]["elements"][0]["distance"]["value"]
         self._write_to_distance_cache(origin, dest, meters)
         return meters
 
+    @metrics.timed("distances", items=len)
+    def get_distances(
+        self,
+        origins: list[Coords],
+        dests: list[Coords],
+        mode: str = "walking",
+    ) -> list[float | None]:
+        """
+        bulk version of `get_distance`, returns the distance from origins[i] to
+        dests[i] for every i
+
+        pairs that are cached or repeated are not sent; the rest is grouped by
+        the shared destination (or origin, whichever needs fewer requests) and
+        packed into distance matrix requests of up to 25 origins/destinations,
+        so e.g. all of the apartments to the city center take n / 25 requests
+
+        :param origins: list of [lat, lng]
+        :param dests: list of [lat, lng], same length as origins
+        :return: distances in meters, None where the API found no route
+        """
+        assert len(origins) == len(dests), "origins and dests differ in length"
+
+        distances = self._get_from_distance_cache(origins, dests)
+        cache_hits = sum(meters is not None for meters in distances)
+        # pairs that share a key are sent once, as the first of them
+        pending: dict[tuple, list[int]] = {}
+        first: dict[bytes, tuple] = {}
+        keys = self._distance_keys(origins, dests)
+        for i, (origin, dest, key) in enumerate(zip(origins, dests, keys)):
+            if distances[i] is not None:
+                continue
+            pair = first.setdefault(
+                key,
+                (tuple(float(x) for x in origin), tuple(float(x) for x in dest)),
+            )
+            pending.setdefault(pair, []).append(i)
+
+        by_dest: dict[tuple, list[tuple]] = {}
+        by_origin: dict[tuple, list[tuple]] = {}
+        for origin, dest in pending:
+            by_dest.setdefault(dest, []).append(origin)
+            by_origin.setdefault(origin, []).append(dest)
+
+        def n_requests(groups: dict, limit: int) -> int:
+            return sum(-(-len(group) // limit) for group in groups.values())
+
+        batches: list[tuple[list[tuple], list[tuple]]] = []
+        if n_requests(by_dest, DISTANCE_MATRIX_MAX_ORIGINS) <= n_requests(
+            by_origin, DISTANCE_MATRIX_MAX_DESTINATIONS
+        ):
+            step = min(DISTANCE_MATRIX_MAX_ORIGINS, DISTANCE_MATRIX_MAX_ELEMENTS)
+            for dest, group in by_dest.items():
+                for j in range(0, len(group), step):
+                    batches.append((group[j:j + step], [dest]))
+        else:
+            step = min(
+                DISTANCE_MATRIX_MAX_DESTINATIONS,
+                DISTANCE_MATRIX_MAX_ELEMENTS,
+            )
+            for origin, group in by_origin.items():
+                for j in range(0, len(group), step):
+                    batches.append(([origin], group[j:j + step]))
+
+        elements = 0
+        for batch_origins, batch_dests in batches:
+            res = self.gmaps.distance_matrix(  # type: ignore
+                origins=[list(origin) for origin in batch_origins],
+                destinations=[list(dest) for dest in batch_dests],
+                mode=mode,
+            )
+            assert res["status"] == "OK", res
+            elements += len(batch_origins) * len(batch_dests)
+            for row, origin in zip(res["rows"], batch_origins):
+                for element, dest in zip(row["elements"], batch_dests):
+                    if element["status"] != "OK":
+                        print("no distance for ", origin, dest, element["status"])
+                        continue
+                    meters = element["distance"]["value"]
+                    self._write_to_distance_cache(
+                        list(origin), list(dest), meters)
+                    for i in pending[(origin, dest)]:
+                        distances[i] = meters
+
+        metrics.count("distance.requests", len(batches))
+        metrics.count("distance.elements", elements)
+        metrics.count("distance.cache_hits", cache_hits)
+        metrics.count("distance.cache_misses", len(origins) - cache_hits)
+        self.distance_stats["pairs"] += len(origins)
+        self.distance_stats["cache_hits"] += cache_hits
+        self.distance_stats["requests"] += len(batches)
+        self.distance_stats["elements"] += elements
+        print(
+            f"distances for {len(origins)} pairs: {cache_hits} cached, "
+            f"{len(batches)} requests / {elements} elements sent, "
+            f"saved {len(origins) - len(batches)} requests and "
+            f"{len(origins) - elements} elements vs one request per pair"
+        )
+        return distances
+
+    def distance_column(
+        self,
+        origins: list[Coords],
+        dests: list[Coords],
+        mode: str | None = None,
+        threshold: float | None = None,
+        margin: float = 0.25,
+    ) -> np.ndarray:
+        """
+        distances in meters from origins[i] to dests[i] for a whole column in
+        one go, computed locally unless the mode is "api"
+
+        with a threshold, only the pairs whose local estimate is within
+        `margin` (relative) of it are sent to the API, the rest is decided the
+        same way by the estimate, e.g. for the `distance_to_center > 20_000`
+        filter
+
+        :param mode: one of DISTANCE_MODES, `self.distance_mode` by default
+        :param threshold: the distance a decision is made at, in meters
+        :param margin: relative band around the threshold that is escalated
+        :return: (N,) float array, NaN where the API found no route
+        """
+        mode = mode or self.distance_mode
+        assert mode in DISTANCE_MODES, mode
+        if not len(origins):
+            return np.empty(0)
+        if len(dests) == 1 and len(origins) != 1:
+            dests = [list(dests[0])] * len(origins)
+
+        if mode == "api":
+            return np.array(
+                self.get_distances(origins, dests),
+                dtype=np.float64,
+            )
+
+        distances = haversine(origins, dests)
+        if mode == "estimate":
+            distances = distances * self.detour_factor
+        if threshold is None:
+            return distances
+
+        escalate = np.flatnonzero(
+            np.abs(distances - threshold) <= margin * threshold)
+        print(
+            f"{len(escalate)} of {len(distances)} pairs within {margin:.0%} of "
+            f"{threshold}m, sending those to the API"
+        )
+        if len(escalate):
+            distances[escalate] = np.array(
+                self.get_distances(
+                    [origins[i] for i in escalate],
+                    [dests[i] for i in escalate],
+                ),
+                dtype=np.float64,
+            )
+        return distances
+
+    def calibrate_detour_factor(
+        self,
+        origins: list[Coords],
+        dests: list[Coords],
+    ) -> float:
+        """
+        sets `detour_factor` from the pairs that already have an API distance
+        in the distance cache, leaves it as it is if there are none
+
+        :return: the detour factor
+        """
+        cached = self._get_from_distance_cache(origins, dests)
+        known = [
+            (origin, dest, meters)
+            for origin, dest, meters in zip(origins, dests, cached)
+            if meters is not None
+        ]
+        if known:
+            self.detour_factor = detour_factor(
+                [origin for origin, _, _ in known],
+                [dest for _, dest, _ in known],
+                [meters for _, _, meters in known],
+            )
+            print(
+                f"calibrated detour factor {self.detour_factor:.3f} "
+                f"on {len(known)} cached distances"
+            )
+        return self.detour_factor
+
     def response_to_coords(self, response: GeocodeResponse) -> Coords:
         return [
             response[0]["geometry"]["location"]["lat"],
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import numbers
+import os
+
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from .rate_limit import RateLimiter
+from .scrape import (
+    OTODOM_URL,
+    compact_item,
+    get_items_from_page,
+    get_page,
+    get_page_count,
+    get_session,
+)
+
+# the fields of an item that make a listing count as changed
+FINGERPRINT_FIELDS = [
+    "title",
+    "locationLabel",
+    "totalPrice",
+    "pricePerSquareMeter",
+    "areaInSquareMeters",
+    "roomsNumber",
+    "hidePrice",
+    "dateCreated",
+    "pushedUpAt",
+]
+
+# newest listings first, so a re-scrape can stop at the first page it has
+# already seen
+LATEST_FIRST = {"by": "LATEST", "direction": "DESC"}
+
+
+def _fingerprint_value(value):
+    # the same item read from JSON and from a DataFrame row has to give the
+    # same fingerprint: numpy scalars, int vs float and NaN vs None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, numbers.Number):
+        return None if value != value else float(value)  # type: ignore
+    return value
+
+
+def item_fingerprint(item: dict) -> str:
+    return hashlib.sha1(
+        json.dumps(
+            [_fingerprint_value(item.get(field)) for field in FINGERPRINT_FIELDS],
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()
+
+
+def items_fingerprints(items_df: pd.DataFrame) -> dict[int, str]:
+    """
+    id: fingerprint of every raw item, including the ones preprocessing or
+    enrichment drop later, so those don't count as new on the next run
+    """
+    return {
+        int(item["id"]): item_fingerprint(item)
+        for item in items_df.to_dict("records")
+    }
+
+
+def load_fingerprints(path: str = "fingerprints.json") -> dict[int, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {int(id): fingerprint for id, fingerprint in json.load(f).items()}
+
+
+def save_fingerprints(fingerprints: dict[int, str], path: str = "fingerprints.json"):
+    with open(path + ".tmp", "w+") as f:
+        json.dump(fingerprints, f)
+    os.replace(path + ".tmp", path)
+
+
+def iter_changed_items(
+    known: dict[int, str],
+    region: str = "pomorskie/gdansk/gdansk/gdansk",
+    stop_after: int = 2,
+    rate: float = 1.0,
+    base_url: str = OTODOM_URL,
+) -> Iterator[dict]:
+    """
+    goes through the listing pages newest first and yields the compact items
+    that are new or whose fingerprint changed, stopping after `stop_after`
+    pages in a row with nothing new
+
+    listings are sorted by creation date, so a price change on an old
+    listing that wasn't pushed up is only picked up by a full run with
+    refresh (see `iter_items`), the same goes for removed listings; the
+    items yielded here aren't written to `items_dir`, so a full run without
+    refresh still reads the items of the last full scrape
+
+    :param known: id: fingerprint of the items seen so far, see
+    `load_fingerprints`
+    :param stop_after: pages without changes before stopping, more than one
+    so a promoted listing on a page doesn't stop the run early
+    """
+    session = get_session(1)
+    rate_limiter = RateLimiter(rate=rate)
+    page_count = None
+    page_number = 1
+    unchanged_pages = 0
+    while page_count is None or page_number <= page_count:
+        page = get_page(
+            page_number,
+            region=region,
+            session=session,
+            rate_limiter=rate_limiter,
+            base_url=base_url,
+            params=LATEST_FIRST,
+        )
+        if page_count is None:
+            page_count = get_page_count(page)
+
+        changed = 0
+        for item in get_items_from_page(page, save=False) or []:
+            if known.get(item["id"]) != item_fingerprint(item):
+                changed += 1
+                yield compact_item(item)
+
+        unchanged_pages = 0 if changed else unchanged_pages + 1
+        if unchanged_pages >= stop_after:
+            print(f"\nno changes on the last {stop_after} pages, stopping")
+            break
+        page_number += 1
+
+
+def merge_delta(
+    final_df: pd.DataFrame,
+    delta_df: pd.DataFrame,
+    changed_ids=None,
+) -> pd.DataFrame:
+    """
+    drops the rows of final_df of every changed listing and appends the
+    enriched delta_df
+
+    :param changed_ids: ids of every new or changed item, including the ones
+    preprocessing or enrichment dropped from delta_df (e.g. the price is now
+    hidden or the listing moved too far from the center), whose old rows
+    would be stale; the ids of delta_df by default
+    """
+    if changed_ids is None:
+        changed_ids = delta_df["id"]
+    kept = final_df[~final_df["id"].isin(changed_ids)]
+    if delta_df.empty:
+        return kept.reset_index(drop=True)
+    return pd.concat([kept, delta_df], ignore_index=True)
@@ -0,0 +1,471 @@
+import io
+import os
+import zipfile
+
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from .ammenities_table import AmmenitiesTable
+
+# upper bounds of the price per m2 bands the apartments are coloured by
+PRICE_BANDS = (10_000, 13_000, 16_000)
+
+# KML colours are aabbggrr: green, yellow, orange and red, one per band
+# (the last one above the last bound), grey for hidden prices
+BAND_COLORS = ["ff00c000", "ff00e0ff", "ff0080ff", "ff0000e0"]
+HIDDEN_PRICE_COLOR = "ff909090"
+
+PLACE_COLORS = ["ffff8000", "ffff00ff", "ffffff00", "ff8000ff",
+                "ff80ff00", "ff0080ff", "ffff0080", "ff00ff80"]
+
+ICON = "http://maps.google.com/mapfiles/kml/shapes/placemark_circle.png"
+
+# the points of a tile are only loaded once it takes this many pixels on
+# screen, below that its aggregate placemark is shown instead
+TILE_LOD_PIXELS = 256
+
+
+class KmlWriter:
+
+    """
+    writes a KML document straight to a text stream, element by element,
+    instead of building the whole tree in memory first like simplekml
+
+    ```Python
+    with open("apartments.kml", "w+") as f, KmlWriter(f, "apartments") as kml:
+        kml.style("cheap", "ff00c000")
+        kml.placemark(54.35, 18.64, "450k PLN", style="cheap")
+    ```
+    """
+
+    def __init__(self, stream: TextIO, name: str):
+        self.stream = stream
+        self.name = name
+
+    def __enter__(self) -> "KmlWriter":
+        self.stream.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+            f"<name>{escape(self.name)}</name>\n"
+        )
+        return self
+
+    def __exit__(self, *exc):
+        self.stream.write("</Document></kml>\n")
+
+    def style(self, style_id: str, color: str, scale: float = 1.0):
+        self.stream.write(
+            f'<Style id="{style_id}"><IconStyle><color>{color}</color>'
+            f"<scale>{scale}</scale><Icon><href>{ICON}</href></Icon>"
+            "</IconStyle><LabelStyle><scale>0.8</scale></LabelStyle></Style>\n"
+        )
+
+    @contextmanager
+    def folder(self, name: str, region: str = "") -> Iterator[None]:
+        self.stream.write(f"<Folder><name>{escape(name)}</name>{region}\n")
+        yield
+        self.stream.write("</Folder>\n")
+
+    def placemark(
+        self,
+        lat: float,
+        lon: float,
+        name: str,
+        description: str | None = None,
+        style: str | None = None,
+    ):
+        self.stream.write(
+            f"<Placemark><name>{escape(name)}</name>"
+            + (f"<description>{escape(description)}</description>"
+               if description else "")
+            + (f"<styleUrl>#{style}</styleUrl>" if style else "")
+            + f"<Point><coordinates>{lon:.6f},{lat:.6f}</coordinates></Point>"
+            "</Placemark>\n"
+        )
+
+    def ground_overlay(
+        self,
+        name: str,
+        href: str,
+        south: float,
+        west: float,
+        north: float,
+        east: float,
+        color: str = "ffffffff",
+    ):
+        """
+        an image stretched over the box, e.g. a heatmap
+
+        :param color: aabbggrr the image is tinted with, the alpha makes it
+        see-through
+        """
+        self.stream.write(
+            f"<GroundOverlay><name>{escape(name)}</name><color>{color}</color>"
+            f"<Icon><href>{escape(href)}</href></Icon>"
+            f"<LatLonBox><north>{north:.6f}</north><south>{south:.6f}</south>"
+            f"<east>{east:.6f}</east><west>{west:.6f}</west></LatLonBox>"
+            "</GroundOverlay>\n"
+        )
+
+    def network_link(self, name: str, href: str, region: str):
+        self.stream.write(
+            f"<NetworkLink><name>{escape(name)}</name>{region}"
+            f"<Link><href>{escape(href)}</href>"
+            "<viewRefreshMode>onRegion</viewRefreshMode></Link>"
+            "</NetworkLink>\n"
+        )
+
+
+def kml_region(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    min_lod_pixels: int = -1,
+    max_lod_pixels: int = -1,
+) -> str:
+    """
+    a <Region>: its feature is only shown (or its network link only
+    fetched) while the box is in view and takes between min_lod_pixels and
+    max_lod_pixels on screen, -1 for no bound
+    """
+    return (
+        "<Region><LatLonAltBox>"
+        f"<north>{north:.6f}</north><south>{south:.6f}</south>"
+        f"<east>{east:.6f}</east><west>{west:.6f}</west>"
+        "</LatLonAltBox>"
+        f"<Lod><minLodPixels>{min_lod_pixels}</minLodPixels>"
+        f"<maxLodPixels>{max_lod_pixels}</maxLodPixels></Lod></Region>"
+    )
+
+
+class _Output:
+
+    """
+    where the files of an export go: next to each other on disk, or into a
+    single KMZ archive (doc.kml first, as viewers expect), written through
+    without buffering the documents
+
+    nothing replaces the previous export until `close` is called with
+    ok=True, tiles the previous export had and this one doesn't are removed
+    then
+    """
+
+    def __init__(self, file_name: str, kmz: bool):
+        self.kmz = kmz
+        self._written: list[str] = []
+        if kmz:
+            self.path = file_name + ".kmz"
+            self._zip = zipfile.ZipFile(
+                self.path + ".tmp", "w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            self.path = file_name + ".kml"
+            self._dir = os.path.dirname(file_name)
+            self._tiles_prefix = os.path.basename(file_name) + "_tiles"
+
+    def href(self, tile: str) -> str:
+        if self.kmz:
+            return f"tiles/{tile}.kml"
+        return f"{self._tiles_prefix}/{tile}.kml"
+
+    @contextmanager
+    def open(self, href: str | None = None) -> Iterator[TextIO]:
+        """
+        :param href: of a tile, see `href`, the main document by default
+        """
+        if self.kmz:
+            with self._zip.open(href or "doc.kml", "w") as raw:
+                with io.TextIOWrapper(raw, encoding="utf-8") as f:
+                    yield f
+            return
+        path = self.path if href is None else os.path.join(self._dir, href)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # tmp files are only moved into place once the whole export is done
+        with open(path + ".tmp", "w+", encoding="utf-8") as f:
+            self._written.append(path)
+            yield f
+
+    def close(self, ok: bool):
+        """
+        :param ok: the export went through, move it into place; otherwise
+        the partially written files are removed and the previous export kept
+        """
+        if self.kmz:
+            self._zip.close()
+            written = [self.path]
+        else:
+            written = self._written
+        for path in written:
+            if ok:
+                os.replace(path + ".tmp", path)
+            elif os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+        if self.kmz:
+            return
+        tiles_dir = os.path.join(self._dir, self._tiles_prefix)
+        if os.path.isdir(tiles_dir):
+            if ok:
+                for name in os.listdir(tiles_dir):
+                    path = os.path.join(tiles_dir, name)
+                    if name.endswith(".kml") and path not in written:
+                        os.remove(path)
+            if not os.listdir(tiles_dir):
+                os.rmdir(tiles_dir)
+
+
+def _quadtree_tiles(
+    coords: np.ndarray,
+    rows: np.ndarray,
+    max_points: int,
+    key: str = "t",
+) -> Iterator[tuple[str, np.ndarray]]:
+    """
+    splits the rows into quadrants of their bounding box until every tile
+    has at most max_points of them
+
+    :return: (key, rows) per tile, keys are the quadrant path, e.g. "t031"
+    """
+    if len(rows) <= max_points or len(key) > 16:
+        yield key, rows
+        return
+    lat, lon = coords[rows, 0], coords[rows, 1]
+    mid_lat = (lat.min() + lat.max()) / 2
+    mid_lon = (lon.min() + lon.max()) / 2
+    quadrants = (lat >= mid_lat).astype(int) * 2 + (lon >= mid_lon)
+    for quadrant in range(4):
+        tile_rows = rows[quadrants == quadrant]
+        if len(tile_rows):
+            yield from _quadtree_tiles(
+                coords, tile_rows, max_points, key + str(quadrant))
+
+
+def write_points(
+    file_name: str,
+    points: pd.DataFrame,
+    styles: dict[str, str],
+    name: str | None = None,
+    max_points: int = 2_000,
+    kmz: bool = False,
+) -> str:
+    """
+    streams the points to file_name.kml (or file_name.kmz)
+
+    sets of more than max_points are split into quadtree tiles of at most
+    max_points each: the main document only holds one aggregate placemark
+    per tile (number of points, median price per m2 if there is one),
+    shown while zoomed out, and a region-bound network link per tile, so a
+    viewer only loads the points of the tiles in view once zoomed in; the
+    tiles go into file_name_tiles/ next to the .kml, or inside the .kmz
+
+    :param points: `lat`, `lon`, `name`, `description` and `style` columns,
+    `price_per_m2` is aggregated per tile if present
+    :param styles: style id: KML colour of the styles the points use
+    :return: path of the main document
+    """
+    name = name or os.path.basename(file_name)
+    output = _Output(file_name, kmz)
+    coords = points[["lat", "lon"]].to_numpy(dtype=np.float64)
+    columns = [points[c].to_numpy() for c in ["lat", "lon", "name", "description", "style"]]
+    price_per_m2 = (
+        points["price_per_m2"].to_numpy(dtype=np.float64, na_value=np.nan)
+        if "price_per_m2" in points else np.full(len(points), np.nan)
+    )
+
+    def write_rows(kml: KmlWriter, rows: np.ndarray):
+        for i in rows:
+            kml.placemark(*(column[i] for column in columns))
+
+    def write_styles(kml: KmlWriter):
+        for style_id, color in styles.items():
+            kml.style(style_id, color)
+
+    try:
+        if len(points) <= max_points:
+            with output.open() as f, KmlWriter(f, name) as kml:
+                write_styles(kml)
+                write_rows(kml, np.arange(len(points)))
+        else:
+            tiles = list(
+                _quadtree_tiles(coords, np.arange(len(points)), max_points))
+            with output.open() as f, KmlWriter(f, name) as kml:
+                kml.style("tile", "ffffffff", scale=1.4)
+                for key, rows in tiles:
+                    (south, west), (north, east) = (
+                        coords[rows].min(axis=0), coords[rows].max(axis=0))
+                    box = (south, west, north, east)
+                    label = f"{len(rows)}"
+                    prices = price_per_m2[rows][~np.isnan(price_per_m2[rows])]
+                    if len(prices):
+                        label += f" | {np.median(prices):,.0f} PLN/m²"
+                    center = coords[rows].mean(axis=0)
+                    with kml.folder(
+                            key, kml_region(*box, max_lod_pixels=TILE_LOD_PIXELS)):
+                        kml.placemark(
+                            center[0], center[1], label,
+                            f"{len(rows)} points, zoom in to load them", "tile")
+                    kml.network_link(
+                        key, output.href(key),
+                        kml_region(*box, min_lod_pixels=TILE_LOD_PIXELS))
+
+            for key, rows in tiles:
+                with output.open(output.href(key)) as f, KmlWriter(f, key) as kml:
+                    # styles don't carry over network links, every tile has
+                    # its own
+                    write_styles(kml)
+                    write_rows(kml, rows)
+            print(f"{len(points)} points split into {len(tiles)} tiles")
+    except BaseException:
+        output.close(ok=False)
+        raise
+    output.close(ok=True)
+    print(f"KML file saved at: {output.path}")
+    return output.path
+
+
+def price_band(price_per_m2: np.ndarray) -> np.ndarray:
+    """
+    style ids of the price per m2 bands, see PRICE_BANDS, "hidden" for NaN
+    """
+    price_per_m2 = np.asarray(price_per_m2, dtype=np.float64)
+    bands = np.searchsorted(PRICE_BANDS, price_per_m2, side="right")
+    return np.where(
+        np.isnan(price_per_m2), "hidden", np.char.add("band", bands.astype(str)))
+
+
+def _band_styles() -> dict[str, str]:
+    return {
+        **{f"band{i}": color for i, color in enumerate(BAND_COLORS)},
+        "hidden": HIDDEN_PRICE_COLOR,
+    }
+
+
+def _format_price(price: float) -> str:
+    if np.isnan(price):
+        return "?"
+    if price >= 1_000_000:
+        return f"{price / 1_000_000:.2f}M"
+    return f"{price / 1_000:.0f}k"
+
+
+def save_apartments_kml(
+    df: pd.DataFrame,
+    file_name: str,
+    ammenities: AmmenitiesTable | None = None,
+    max_points: int = 2_000,
+    kmz: bool = False,
+) -> str:
+    """
+    one placemark per apartment, labelled with the price and price per m2,
+    coloured by price band (see PRICE_BANDS) and described with the address,
+    floor size, rooms, url and the closest ammenities
+
+    :param df: with `coords`, `price`, `price_per_m2` and optionally the
+    `closest_<type>` / `distance_to_closest_<type>` columns of the
+    closest_ammenities stage
+    :param ammenities: table the closest ammenities are looked up in to
+    name them, without it they are only listed by distance
+    """
+    df = df[df["coords"].notna()]
+    coords = np.array(df["coords"].tolist(), dtype=np.float64).reshape(-1, 2)
+    price = df["price"].to_numpy(dtype=np.float64, na_value=np.nan)
+    price_per_m2 = df["price_per_m2"].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    names = [
+        f"{_format_price(p)} PLN" + (
+            f" | {m2:,.0f}/m²" if not np.isnan(m2) else "")
+        for p, m2 in zip(price, price_per_m2)
+    ]
+
+    lines = [[] for _ in range(len(df))]
+    for column, label in [("address", ""), ("floor_size", " m²"),
+                          ("number_of_rooms", " rooms")]:
+        if column in df:
+            for line, value in zip(lines, df[column].tolist()):
+                if pd.notna(value):
+                    line.append(f"{value}{label}")
+    for column in [c for c in df.columns if c.startswith("distance_to_closest_")]:
+        ammenity = column.removeprefix("distance_to_closest_")
+        distances = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        place_names = [ammenity] * len(df)
+        if ammenities is not None and ammenity in ammenities.types \
+                and f"closest_{ammenity}" in df:
+            view = ammenities.view(ammenity)
+            if len(view):
+                closest = df[f"closest_{ammenity}"]
+                found = closest.notna().to_numpy()
+                if found.any():
+                    indices, _ = view.index.nearest(
+                        np.array(closest[found].tolist(), dtype=np.float64))
+                    for i, name in zip(np.flatnonzero(found), view.name[indices]):
+                        place_names[i] = f"{ammenity}: {name}"
+        for line, place, distance in zip(lines, place_names, distances):
+            if not np.isnan(distance):
+                line.append(f"{place} ({distance:,.0f} m)")
+    if "url" in df:
+        for line, url in zip(lines, df["url"].tolist()):
+            if pd.notna(url):
+                line.append(url)
+
+    points = pd.DataFrame({
+        "lat": coords[:, 0],
+        "lon": coords[:, 1],
+        "name": names,
+        "description": ["\n".join(line) for line in lines],
+        "style": price_band(price_per_m2),
+        "price_per_m2": price_per_m2,
+    })
+    return write_points(
+        file_name, points, _band_styles(), max_points=max_points, kmz=kmz)
+
+
+def save_places_kml(
+    table: AmmenitiesTable,
+    file_name: str,
+    max_points: int = 2_000,
+    kmz: bool = False,
+) -> str:
+    """
+    one placemark per place, labelled with its name, coloured by ammenity
+    type and described with the type and rating
+    """
+    types = np.asarray(table.types, dtype=object)[table.codes]
+    ratings = np.asarray(table.rating, dtype=np.float64)
+    points = pd.DataFrame({
+        "lat": table.lat,
+        "lon": table.lon,
+        "name": np.asarray(table.name, dtype=object),
+        "description": [
+            ammenity + (f", rating {rating:.1f}" if not np.isnan(rating) else "")
+            for ammenity, rating in zip(types, ratings)
+        ],
+        "style": [f"type{code}" for code in table.codes],
+    })
+    styles = {
+        f"type{code}": PLACE_COLORS[code % len(PLACE_COLORS)]
+        for code in range(len(table.types))
+    }
+    return write_points(file_name, points, styles, max_points=max_points, kmz=kmz)
+
+
+def save_coords_kml(
+    file_name: str,
+    list_of_coords: list[list[float]],
+    name: str = "Cluster Center",
+) -> str:
+    """
+    unlabelled points, e.g. the places search centers
+    """
+    coords = np.asarray(list_of_coords, dtype=np.float64).reshape(-1, 2)
+    points = pd.DataFrame({
+        "lat": coords[:, 0],
+        "lon": coords[:, 1],
+        "name": name,
+        "description": None,
+        "style": None,
+    })
+    return write_points(file_name, points, {})
@@ -0,0 +1,185 @@
+import atexit
+import os
+import pickle
+import sqlite3
+import threading
+
+from typing import Any, Iterator
+
+from . import metrics
+
+
+class KVStore:
+
+    """
+    persistent key-value store backed by SQLite in WAL mode, used for the
+    HowCloseIsItService caches instead of re-pickling a whole dict per write
+
+    writes are buffered and committed in batches of `batch_size` (and on
+    `flush`/`close`/exit), so a crash loses at most the last uncommitted batch
+    and never corrupts what is already on disk; values are pickled
+    """
+
+    def __init__(
+        self,
+        path: str,
+        legacy_pickle: str | None = None,
+        batch_size: int = 100,
+    ):
+        """
+        :param path: path of the SQLite database file
+        :param legacy_pickle: a pickled dict to import the first time the
+        database is created, e.g. the old `cache.pkl`
+        :param batch_size: number of buffered writes before a commit
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self._pending: dict[Any, bytes] = {}
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            path,
+            timeout=30,
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key PRIMARY KEY, value BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        self._compact()
+        if legacy_pickle is not None and os.path.exists(legacy_pickle):
+            self._import_legacy_pickle(legacy_pickle)
+        atexit.register(self.close)
+
+    def _compact(self):
+        """
+        folds whatever a previous (possibly crashed) run left in the WAL back
+        into the main file and vacuums if more than a quarter of it is free
+        """
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = self._conn.execute(
+            "PRAGMA freelist_count").fetchone()[0]
+        if page_count and freelist_count / page_count > 0.25:
+            self._conn.execute("VACUUM")
+
+    def _import_legacy_pickle(self, legacy_pickle: str):
+        if len(self):
+            return
+        with open(legacy_pickle, "rb") as f:
+            legacy = pickle.load(f)
+        self.update(legacy)
+        self.flush()
+        print(f"Imported {len(legacy)} entries from {legacy_pickle} into {self.path}")
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            if key in self._pending:
+                return True
+            row = self._conn.execute(
+                "SELECT 1 FROM kv WHERE key = ?", (key,)).fetchone()
+            return row is not None
+
+    def __getitem__(self, key) -> Any:
+        with self._lock:
+            if key in self._pending:
+                return pickle.loads(self._pending[key])
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        metrics.count("cache.bytes_read", len(row[0]))
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key, value: Any):
+        with self._lock:
+            self._pending[key] = pickle.dumps(value)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.flush()
+            return self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.keys())
+
+    def get(self, key, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_many(self, keys: list) -> dict:
+        """
+        the values of the keys that are in the store, in a few queries
+        instead of one per key
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._pending:
+                    found[key] = pickle.loads(self._pending[key])
+            missing = list({key for key in keys if key not in found})
+            rows = []
+            # SQLite allows up to 999 parameters per query in older builds
+            for i in range(0, len(missing), 900):
+                chunk = missing[i:i + 900]
+                rows += self._conn.execute(
+                    f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+        metrics.count("cache.bytes_read", sum(len(value) for _, value in rows))
+        found.update((key, pickle.loads(value)) for key, value in rows)
+        return found
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+            with self._conn:
+                self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def update(self, items: dict):
+        with self._lock:
+            for key, value in items.items():
+                self._pending[key] = pickle.dumps(value)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def keys(self) -> list:
+        with self._lock:
+            self.flush()
+            return [row[0] for row in self._conn.execute("SELECT key FROM kv")]
+
+    def items(self) -> Iterator[tuple[Any, Any]]:
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute("SELECT key, value FROM kv").fetchall()
+        for key, value in rows:
+            yield key, pickle.loads(value)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            metrics.count(
+                "cache.bytes_written",
+                sum(len(value) for value in self._pending.values()),
+            )
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                    self._pending.items(),
+                )
+            self._pending.clear()
+
+    def close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            self.flush()
+            self._conn.close()
+            self._conn = None  # type: ignore
+        atexit.unregister(self.close)
@@ -0,0 +1,144 @@
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+_lock = threading.Lock()
+_local = threading.local()
+
+# stage name: {"calls", "seconds", "items"}, seconds is summed over threads,
+# so a stage that runs on a pool can take longer than the wall time
+_stages: dict[str, dict[str, float]] = {}
+# api calls, cache hits/misses, bytes read/written, ...
+_counters: Counter = Counter()
+
+_profile_dir: str | None = os.getenv("PROFILE_DIR")
+
+
+def enable_profiling(profile_dir: str | None = "profiles"):
+    """
+    dump a cProfile of every outermost stage of the main thread to
+    profile_dir/<stage>.prof, None turns it off; also set by the PROFILE_DIR
+    env var
+    """
+    global _profile_dir
+    _profile_dir = profile_dir
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+
+
+def count(name: str, n: float = 1):
+    with _lock:
+        _counters[name] += n
+
+
+def add_items(name: str, n: int):
+    """
+    adds to the items processed by a stage, for stages that only know how
+    many items they did once they're done
+    """
+    with _lock:
+        _stages.setdefault(name, {"calls": 0, "seconds": 0.0, "items": 0})
+        _stages[name]["items"] += n
+
+
+@contextmanager
+def stage(name: str, items: int = 0) -> Iterator[None]:
+    """
+    times the block under `name`, stages can nest
+
+    :param items: how many items the block processes, see also `add_items`
+    """
+    depth = getattr(_local, "depth", 0)
+    profiler = None
+    # cProfile only sees the thread it's enabled in, so stages running on
+    # worker threads are timed but not profiled
+    if (
+        _profile_dir is not None
+        and depth == 0
+        and threading.current_thread() is threading.main_thread()
+    ):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    _local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _local.depth = depth
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(_profile_dir, exist_ok=True)  # type: ignore
+            profiler.dump_stats(
+                os.path.join(_profile_dir, f"{name}.prof"))  # type: ignore
+        with _lock:
+            record = _stages.setdefault(
+                name, {"calls": 0, "seconds": 0.0, "items": 0})
+            record["calls"] += 1
+            record["seconds"] += elapsed
+            record["items"] += items
+
+
+def timed(
+    name: str | None = None,
+    items: Callable[[Any], int] | None = None,
+) -> Callable:
+    """
+    decorator version of `stage`
+
+    :param name: stage name, the function's qualified name by default
+    :param items: gets the return value, returns the number of items
+    processed, e.g. `len`
+    """
+    def decorator(fn: Callable) -> Callable:
+        stage_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                result = fn(*args, **kwargs)
+            if items is not None and result is not None:
+                add_items(stage_name, items(result))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def report(path: str | None = None) -> dict:
+    """
+    the stages and counters recorded so far, written as JSON to path if
+    given
+    """
+    with _lock:
+        run_report = {
+            "stages": {
+                name: {
+                    **record,
+                    "items_per_second": record["items"] / record["seconds"]
+                    if record["seconds"] and record["items"]
+                    else None,
+                }
+                for name, record in _stages.items()
+            },
+            "counters": dict(_counters),
+        }
+    if path is not None:
+        with open(path, "w+") as f:
+            json.dump(run_report, f, indent=2)
+        print(f"run report saved at: {path}")
+    return run_report
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
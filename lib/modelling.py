@@ -0,0 +1,219 @@
+import hashlib
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LinearRegression, RidgeCV
+from sklearn.metrics import (
+    mean_absolute_error,
+    mean_absolute_percentage_error,
+    r2_score,
+    root_mean_squared_error,
+)
+from sklearn.model_selection import KFold, cross_val_predict
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from . import metrics
+
+BASE_FEATURES = ["floor_size", "number_of_rooms"]
+
+TARGET = "price"
+
+# the estimators are single-threaded, the parallelism is across the
+# (model, fold) pairs so the cores don't get oversubscribed
+MODELS = {
+    "linear": lambda: LinearRegression(),
+    "ridge": lambda: RidgeCV(alphas=np.logspace(-3, 3, 13)),
+    "random_forest": lambda: RandomForestRegressor(
+        n_estimators=200, min_samples_leaf=2, random_state=0, n_jobs=1),
+    "gradient_boosting": lambda: HistGradientBoostingRegressor(random_state=0),
+}
+
+DEFAULT_MODEL = "gradient_boosting"
+
+
+def feature_columns(df: pd.DataFrame) -> list[str]:
+    """
+    floor size, number of rooms and whatever the enrichment added: the
+    distance to the center, the distances to the closest ammenities and the
+    ammenity counts of the accessibility grid
+    """
+    return BASE_FEATURES + [
+        column for column in df.columns
+        if column == "distance_to_center"
+        or column.startswith("distance_to_closest_")
+        or (column.endswith("m") and "_within_" in column)
+    ]
+
+
+def training_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    the listings with a price and a floor size, hidden prices are NaN
+    """
+    return df[
+        df[TARGET].notna() & (df[TARGET] > 0) & df["floor_size"].notna()
+    ]
+
+
+def make_pipeline(model: str = DEFAULT_MODEL) -> TransformedTargetRegressor:
+    """
+    imputes and scales the features and fits the model on log prices,
+    predictions come back as prices
+    """
+    return TransformedTargetRegressor(
+        regressor=Pipeline([
+            ("impute", SimpleImputer(strategy="median")),
+            ("scale", StandardScaler()),
+            ("model", MODELS[model]()),
+        ]),
+        func=np.log,
+        inverse_func=np.exp,
+    )
+
+
+def _score(y_true: np.ndarray, y_pred: np.ndarray) -> dict[str, float]:
+    return {
+        "rmse": root_mean_squared_error(y_true, y_pred),
+        "mae": mean_absolute_error(y_true, y_pred),
+        "mape": mean_absolute_percentage_error(y_true, y_pred),
+        "r2": r2_score(y_true, y_pred),
+    }
+
+
+def _fit_and_score(model: str, X, y, train, test) -> dict:
+    pipeline = make_pipeline(model).fit(X.iloc[train], y[train])
+    return {"model": model, **_score(y[test], pipeline.predict(X.iloc[test]))}
+
+
+@metrics.timed("compare_models")
+def compare_models(
+    df: pd.DataFrame,
+    models: list[str] | None = None,
+    folds: int = 5,
+    n_jobs: int = -1,
+) -> pd.DataFrame:
+    """
+    k-fold cross-validates every model on the same folds, all of the
+    (model, fold) fits run in parallel
+
+    :param models: names of MODELS, all of them by default
+    :param n_jobs: joblib processes, -1 for all of the cores
+    :return: mean and std of rmse, mae, mape and r2 per model, best rmse first
+    """
+    df = training_frame(df)
+    X, y = df[feature_columns(df)], df[TARGET].to_numpy()
+    splits = KFold(n_splits=folds, shuffle=True, random_state=0).split(X)
+    scores = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_and_score)(model, X, y, train, test)
+        for train, test in splits
+        for model in models or MODELS
+    )
+    return (
+        pd.DataFrame(scores)
+        .groupby("model")
+        .agg(["mean", "std"])
+        .sort_values(("rmse", "mean"))
+    )
+
+
+def data_hash(X: pd.DataFrame, y: np.ndarray) -> str:
+    """
+    hash of the features (columns included) and the target, what a fitted
+    pipeline is cached under together with the model
+    """
+    digest = hashlib.sha256()
+    digest.update(",".join(X.columns).encode())
+    digest.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    digest.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def fit_pipeline(
+    df: pd.DataFrame,
+    model: str = DEFAULT_MODEL,
+    cache_dir: str | None = "models",
+) -> TransformedTargetRegressor:
+    """
+    fits the model on all of the listings with a price, a pipeline already
+    fitted on the same data (and sklearn version) is loaded from cache_dir
+    instead
+
+    :param cache_dir: None to always fit
+    """
+    df = training_frame(df)
+    X, y = df[feature_columns(df)], df[TARGET].to_numpy()
+    key = f"{model}-{data_hash(X, y)[:16]}-{sklearn.__version__}"
+    path = os.path.join(cache_dir, f"{key}.joblib") if cache_dir else None
+    if path is not None and os.path.exists(path):
+        metrics.count("models.cache_hits")
+        return joblib.load(path)
+
+    with metrics.stage("fit_pipeline", items=len(X)):
+        pipeline = make_pipeline(model).fit(X, y)
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)  # type: ignore
+        joblib.dump(pipeline, path)
+        print(f"pipeline saved at: {path}")
+    return pipeline
+
+
+def score_listings(
+    df: pd.DataFrame,
+    pipeline: TransformedTargetRegressor | None = None,
+    model: str = DEFAULT_MODEL,
+    n_jobs: int = -1,
+) -> pd.DataFrame:
+    """
+    adds `predicted_price` and `price_ratio` (price / predicted_price, below
+    1 is cheaper than comparable listings) to every listing
+
+    :param pipeline: a fitted pipeline (see `fit_pipeline`) to score new
+    listings with; without one the listings are scored out-of-fold, so no
+    listing is scored by a model that has seen it
+    """
+    df = df.copy()
+    features = feature_columns(df)
+    if pipeline is not None:
+        df["predicted_price"] = pipeline.predict(df[features])
+    else:
+        train = training_frame(df)
+        df["predicted_price"] = np.nan
+        df.loc[train.index, "predicted_price"] = cross_val_predict(
+            clone(make_pipeline(model)),
+            train[features],
+            train[TARGET].to_numpy(),
+            cv=KFold(n_splits=5, shuffle=True, random_state=0),
+            n_jobs=n_jobs,
+        )
+    df["price_ratio"] = df[TARGET] / df["predicted_price"]
+    return df
+
+
+def rank_underpriced(
+    df: pd.DataFrame,
+    pipeline: TransformedTargetRegressor | None = None,
+    max_price: float | None = 500_000,
+    top: int | None = 30,
+) -> pd.DataFrame:
+    """
+    the listings priced furthest below what the model expects, see
+    `score_listings`
+
+    :param max_price: leave out listings above the price
+    :param top: number of listings to return, None for all
+    """
+    scored = score_listings(df, pipeline)
+    scored = scored[scored["address"].notna() & scored["price_ratio"].notna()]
+    if max_price is not None:
+        scored = scored[scored[TARGET] <= max_price]
+    ranked = scored.sort_values("price_ratio")
+    return ranked if top is None else ranked.head(top)
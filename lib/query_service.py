@@ -0,0 +1,256 @@
+import json
+import threading
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from .spatial import SpatialIndex
+
+# returned with every offer, next to the columns filtered and sorted on
+OFFER_FIELDS = ["id", "title", "url", "address", "price", "price_per_m2",
+                "floor_size", "number_of_rooms"]
+
+# most offers a query returns, larger limits are capped to it
+MAX_LIMIT = 1_000
+
+
+class QueryError(ValueError):
+    pass
+
+
+class OfferIndex:
+
+    """
+    the enriched listings held as numpy columns, with every numeric column
+    sorted once (for range filters) and a spatial index over the listings
+    (for radius filters), so a query only touches the listings in its most
+    selective range
+
+    built from what `load_dataset` returns, i.e. with `coords_lat` and
+    `coords_lon` columns
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        df = df.reset_index(drop=True)
+        self.size = len(df)
+        self.columns = {
+            column: df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+            for column in df.columns
+            if pd.api.types.is_numeric_dtype(df[column])
+            and not pd.api.types.is_bool_dtype(df[column])
+        }
+        self.fields = {
+            column: df[column].astype(object).where(df[column].notna(), None).to_numpy()
+            for column in OFFER_FIELDS
+            if column in df
+        }
+        # NaNs sort last, so searchsorted never returns them
+        self._order = {
+            column: np.argsort(values, kind="stable")
+            for column, values in self.columns.items()
+        }
+        self._sorted = {
+            column: values[self._order[column]]
+            for column, values in self.columns.items()
+        }
+        self.coords = np.column_stack(
+            [self.columns["coords_lat"], self.columns["coords_lon"]])
+        self._spatial = SpatialIndex(np.nan_to_num(self.coords))
+
+    def _range(self, column: str, low: float, high: float) -> np.ndarray:
+        """
+        indices of the rows with low <= column <= high
+        """
+        sorted_values = self._sorted[column]
+        start = np.searchsorted(sorted_values, low, side="left")
+        stop = np.searchsorted(sorted_values, high, side="right")
+        return self._order[column][start:stop]
+
+    def query(
+        self,
+        ranges: dict[str, tuple[float, float]] | None = None,
+        within: tuple[float, float, float] | None = None,
+        sort: str = "price_per_m2",
+        descending: bool = False,
+        limit: int = 20,
+    ) -> list[dict]:
+        """
+        :param ranges: column: (low, high), inclusive, e.g.
+        {"price": (0, 500_000), "distance_to_closest_skm": (0, 800)}
+        :param within: (lat, lng, meters) the listings have to be within
+        :param sort: column the results are ordered by, NaNs never make it
+        :param limit: number of offers returned, at most MAX_LIMIT
+        :return: the offers, OFFER_FIELDS plus the columns filtered and
+        sorted on
+        """
+        if limit < 0:
+            raise QueryError(f"limit has to be non-negative, got {limit}")
+        limit = min(limit, MAX_LIMIT)
+        ranges = dict(ranges or {})
+        for column in [*ranges, sort]:
+            if column not in self.columns:
+                raise QueryError(f"unknown numeric column: {column}")
+
+        # seed the candidates with the most selective range, narrowed down
+        # by vectorized masks of the other filters
+        sizes = {
+            column: np.searchsorted(self._sorted[column], high, side="right")
+            - np.searchsorted(self._sorted[column], low, side="left")
+            for column, (low, high) in ranges.items()
+        }
+        if sizes:
+            seed = min(sizes, key=sizes.__getitem__)
+            candidates = self._range(seed, *ranges.pop(seed))
+        else:
+            candidates = np.arange(self.size)
+        if within is not None:
+            lat, lng, meters = within
+            near = self._spatial.within_radius([[lat, lng]], meters)[0][0]
+            candidates = np.intersect1d(candidates, near, assume_unique=True)
+        mask = np.ones(len(candidates), dtype=bool)
+        for column, (low, high) in ranges.items():
+            values = self.columns[column][candidates]
+            mask &= (values >= low) & (values <= high)
+        candidates = candidates[mask]
+
+        keys = self.columns[sort][candidates]
+        candidates, keys = candidates[~np.isnan(keys)], keys[~np.isnan(keys)]
+        keys = -keys if descending else keys
+        if len(candidates) > limit:
+            top = np.argpartition(keys, limit)[:limit]
+            candidates, keys = candidates[top], keys[top]
+        candidates = candidates[np.argsort(keys, kind="stable")]
+
+        returned = [sort, *ranges, *sizes]
+        return [
+            {
+                **{field: values[i] for field, values in self.fields.items()},
+                **{
+                    column: None if np.isnan(self.columns[column][i])
+                    else float(self.columns[column][i])
+                    for column in dict.fromkeys(returned)
+                },
+            }
+            for i in candidates.tolist()
+        ]
+
+    def parse_query(self, query: dict[str, list[str]]) -> dict:
+        """
+        turns the query string of a request into `query` kwargs:
+
+        - `min_<column>` / `max_<column>` for any numeric column
+        - `near=<ammenity>:<meters>`, short for max_distance_to_closest_<ammenity>
+        - `lat`, `lng` and `radius` (meters) for a radius around a point
+        - `sort=<column>` or `sort=-<column>` for descending, price_per_m2
+        by default
+        - `limit`, 20 by default, at most MAX_LIMIT
+        """
+        ranges: dict[str, list[float]] = {}
+        within = None
+        try:
+            for key, values in query.items():
+                value = values[-1]
+                if key.startswith(("min_", "max_")):
+                    bounds = ranges.setdefault(key[4:], [-np.inf, np.inf])
+                    bounds[key.startswith("max_")] = float(value)
+                elif key == "near":
+                    for near in values:
+                        ammenity, meters = near.rsplit(":", 1)
+                        bounds = ranges.setdefault(
+                            f"distance_to_closest_{ammenity}", [-np.inf, np.inf])
+                        bounds[1] = float(meters)
+            if "radius" in query:
+                within = (
+                    float(query["lat"][-1]),
+                    float(query["lng"][-1]),
+                    float(query["radius"][-1]),
+                )
+            sort = query.get("sort", ["price_per_m2"])[-1]
+            limit = int(query.get("limit", ["20"])[-1])
+        except (KeyError, ValueError) as e:
+            raise QueryError(f"bad query: {e}")
+        if limit < 0:
+            raise QueryError(f"limit has to be non-negative, got {limit}")
+        return {
+            "ranges": {column: tuple(bounds) for column, bounds in ranges.items()},
+            "within": within,
+            "sort": sort.lstrip("-"),
+            "descending": sort.startswith("-"),
+            "limit": limit,
+        }
+
+
+class _OfferServer(ThreadingHTTPServer):
+    # the default backlog of 5 drops connections under concurrent clients,
+    # which then wait out a SYN retransmit
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def _make_handler(index: OfferIndex):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body):
+            payload = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                self._send_json(200, {"offers": index.size})
+            elif url.path == "/columns":
+                self._send_json(200, sorted(index.columns))
+            elif url.path == "/offers":
+                try:
+                    kwargs = index.parse_query(parse_qs(url.query))
+                    self._send_json(200, index.query(**kwargs))
+                except QueryError as e:
+                    self._send_json(400, {"error": str(e)})
+            else:
+                self._send_json(404, {"error": f"no such path: {url.path}"})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def make_offer_server(
+    df: pd.DataFrame,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+) -> ThreadingHTTPServer:
+    """
+    HTTP/JSON server answering from an `OfferIndex` of df, e.g.
+    `GET /offers?max_price=500000&near=skm:800&limit=10` for the 10 offers
+    under 500k within 800m of an SKM stop with the lowest price per m2
+
+    see `OfferIndex.parse_query` for the parameters, `/columns` lists the
+    columns they take
+    """
+    return _OfferServer((host, port), _make_handler(OfferIndex(df)))
+
+
+@contextmanager
+def serve_offers(df: pd.DataFrame, host: str = "127.0.0.1", port: int = 0):
+    """
+    runs `make_offer_server` on a background thread
+
+    :param port: 0 picks a free one
+    :return: base_url of the server
+    """
+    server = make_offer_server(df, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
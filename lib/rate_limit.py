@@ -0,0 +1,34 @@
+import threading
+import time
+
+
+class RateLimiter:
+
+    """
+    thread-safe token bucket, `acquire` blocks until a token is available
+
+    :param rate: tokens added per second, i.e. the sustained requests per second
+    :param burst: bucket size, i.e. how many requests can go out back to back
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._last) * self.rate,
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
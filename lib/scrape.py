@@ -1,14 +1,32 @@
 import re
 import requests
+import requests.adapters
 import pickle
 import os
 import json
+import gzip
+import time
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
 from bs4 import BeautifulSoup
 
+from . import metrics
+from .rate_limit import RateLimiter
 
-def get_page_count(soup: BeautifulSoup) -> int:
-    text = str(soup)
+try:
+    # optional, a few times faster than json on the ~300KB __NEXT_DATA__
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
+def get_page_count(page: BeautifulSoup | str) -> int:
+    """
+    :param page: raw HTML of the page, or its soup
+    """
+    text = page if isinstance(page, str) else str(page)
 
     # Search for "page_count":XX in the text
     match = re.search('"page_count":([0-9]+)', text)
@@ -21,25 +39,83 @@ def get_page_count(soup: BeautifulSoup) -> int:
         raise Exception("No match found.")
 
 
+OTODOM_URL = "https://www.otodom.pl/pl/wyniki/sprzedaz/mieszkanie"
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (iPad; CPU OS 12_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148"
+}
+
+
+def get_session(pool_size: int = 8) -> requests.Session:
+    """
+    a session with a connection pool big enough for `pool_size` concurrent
+    page fetches, shared by all of the workers of `get_pages`
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
 def get_page(
-    page_number: int = 1, region: str = "pomorskie/gdansk/gdansk/gdansk"
+    page_number: int = 1,
+    region: str = "pomorskie/gdansk/gdansk/gdansk",
+    session: requests.Session | None = None,
+    rate_limiter: RateLimiter | None = None,
+    base_url: str = OTODOM_URL,
+    retries: int = 3,
+    backoff: float = 2.0,
+    params: dict | None = None,
 ) -> str:
-    headers = {
-        "User-Agent": "Mozilla/5.0 (iPad; CPU OS 12_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148"
+    """
+    :param session: session to reuse connections from, plain requests if None
+    :param rate_limiter: acquired before every attempt, including retries
+    :param base_url: listing url without the region, can point at a local
+    stand-in serving saved pages
+    :param retries: how many times to retry a failed request
+    :param backoff: seconds to wait before the first retry, doubled after
+    each next one
+    :param params: extra query params, e.g. the sort order
+    """
+    params = {
+        "viewType": "listing",
+        "limit": 72,
+        "page": page_number,
+        **(params or {}),
     }
 
-    params = {"viewType": "listing", "limit": 72, "page": page_number}
+    for attempt in range(retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            r = (session or requests).get(
+                f"{base_url}/{region}",
+                headers=HEADERS,
+                params=params,
+                timeout=30,
+            )
+        except requests.RequestException as e:
+            if attempt == retries:
+                raise
+            print(f"page {page_number} failed ({e}), retrying")
+        else:
+            if r.ok:
+                print(page_number, end=" ")
+                metrics.count("scrape.requests")
+                metrics.count("scrape.bytes_read", len(r.content))
+                return r.text
+            if attempt == retries:
+                raise Exception(r.text)
+            print(f"page {page_number} got {r.status_code}, retrying")
+        metrics.count("scrape.retries")
+        time.sleep(backoff * 2**attempt)
 
-    r = requests.get(
-        f"https://www.otodom.pl/pl/wyniki/sprzedaz/mieszkanie/{region}",
-        headers=headers,
-        params=params,
-    )
-    print(page_number, end=" ")
-    if not r.ok:
-        raise Exception(r.text)
-
-    return r.text
+    raise AssertionError("unreachable")
 
 
 def save_pages(pages: list):
@@ -47,22 +123,82 @@ def save_pages(pages: list):
         pickle.dump(pages, f)
 
 
-def get_pages(load: bool = True, save: bool = True) -> list:
+def pages_dir(region: str) -> str:
+    """
+    directory where `get_pages` keeps every fetched page of the region, this
+    is what lets an interrupted scrape resume
+    """
+    return os.path.join("pages", region.replace("/", "_"))
+
+
+def _page_path(region: str, page_number: int) -> str:
+    return os.path.join(pages_dir(region), f"{page_number}.html")
+
+
+def _read_page(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def _write_page(path: str, page: str):
+    # write-then-rename so a killed run never leaves a truncated page behind
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(page)
+    os.replace(path + ".tmp", path)
+
+
+def get_pages(
+    load: bool = True,
+    save: bool = True,
+    region: str = "pomorskie/gdansk/gdansk/gdansk",
+    workers: int = 4,
+    rate: float = 1.0,
+    burst: int = 2,
+    base_url: str = OTODOM_URL,
+) -> list:
+    """
+    fetches all of the listing pages of the region concurrently
+
+    every page is written to `pages_dir(region)` as soon as it arrives and
+    pages already there are not fetched again, so re-running after a crash or
+    a ban picks up where the previous run stopped
+
+    :param load: return pages.pkl if it exists instead of scraping
+    :param save: pickle the pages to pages.pkl
+    :param workers: number of concurrent fetches
+    :param rate: sustained requests per second across all workers
+    :param burst: how many requests can go out back to back
+    :param base_url: see `get_page`
+    :return: list of HTML pages in page order
+    """
     if os.path.exists("pages.pkl") and load:
         print("getting pages from pages.pkl file")
         with open("pages.pkl", "rb") as f:
             return pickle.load(f)
-    else:
-        soup = BeautifulSoup(get_page(), "lxml")
 
-        page_count = get_page_count(soup)
+    os.makedirs(pages_dir(region), exist_ok=True)
+    session = get_session(workers)
+    rate_limiter = RateLimiter(rate=rate, burst=burst)
 
-        pages = []
-        for i in range(1, page_count):
-            import time
+    def fetch(page_number: int) -> str:
+        path = _page_path(region, page_number)
+        if os.path.exists(path):
+            return _read_page(path)
+        page = get_page(
+            page_number,
+            region=region,
+            session=session,
+            rate_limiter=rate_limiter,
+            base_url=base_url,
+        )
+        _write_page(path, page)
+        return page
 
-            time.sleep(3)
-            pages.append(get_page(i))
+    first_page = fetch(1)
+    page_count = get_page_count(first_page)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = [first_page, *executor.map(fetch, range(2, page_count + 1))]
 
     if save:
         save_pages(pages)
@@ -70,6 +206,52 @@ def get_pages(load: bool = True, save: bool = True) -> list:
     return pages
 
 
+_NEXT_DATA_TAG = re.compile(r'<script[^>]*\bid="__NEXT_DATA__"[^>]*>')
+
+
+def extract_next_data(page: str) -> dict:
+    """
+    slices the JSON payload of the __NEXT_DATA__ script tag straight out of
+    the raw HTML, without building a soup of the whole ~700KB page
+
+    :raises ValueError: if the tag is not there or its payload isn't JSON
+    """
+    match = _NEXT_DATA_TAG.search(page)
+    if match is None:
+        raise ValueError("No __NEXT_DATA__ script tag found")
+    end = page.find("</script>", match.end())
+    if end == -1:
+        raise ValueError("Unterminated __NEXT_DATA__ script tag")
+    return json_loads(page[match.end():end])
+
+
+def _extract_next_data_with_soup(page: str) -> dict:
+    soup = BeautifulSoup(page, "lxml")
+    next_data_script = soup.find("script", {"id": "__NEXT_DATA__"})
+    assert next_data_script is not None, "No __NEXT_DATA__ script tag found"
+    return json.loads(next_data_script.string)  # type: ignore
+
+
+def get_next_data(page: str) -> dict:
+    """
+    `extract_next_data`, falling back to finding the tag in a soup of the
+    page when the markup doesn't look like what the slicing expects
+    """
+    try:
+        return extract_next_data(page)
+    except ValueError:
+        return _extract_next_data_with_soup(page)
+
+
+def get_search_ads(page: str) -> dict:
+    """
+    :return: the searchAds object of the page, with the `items` and the
+    `pagination` ({ totalResults, itemsPerPage, page, totalPages })
+    """
+    return get_next_data(page)["props"]["pageProps"]["data"]["searchAds"]
+
+
+@metrics.timed("parse", items=len)
 def get_items_from_page(page: str, save: bool = True) -> list:
     """
     uses the __NEXT_DATA__ script tag to get the search results
@@ -78,11 +260,158 @@ def get_items_from_page(page: str, save: bool = True) -> list:
     :param save: if True, saves the data to data.json, useful for debugging
     :return: list of items
     """
-    soup = BeautifulSoup(page, "lxml")
-    next_data_script = soup.find("script", {"id": "__NEXT_DATA__"})
-    assert next_data_script is not None, "No __NEXT_DATA__ script tag found"
-    data = json.loads(next_data_script.string)  # type: ignore
+    data = get_next_data(page)
     if save:
         with open("data.json", "w+") as f:
             f.write(json.dumps(data))
     return data["props"]["pageProps"]["data"]["searchAds"]["items"]
+
+
+# the fields of a search item that the rest of the pipeline reads, the rest
+# (images, seo, agency, ...) is most of the size of an item
+ITEM_FIELDS = [
+    "id",
+    "title",
+    "slug",
+    "estate",
+    "transaction",
+    "developmentId",
+    "developmentTitle",
+    "location",
+    "locationLabel",
+    "totalPrice",
+    "pricePerSquareMeter",
+    "areaInSquareMeters",
+    "roomsNumber",
+    "hidePrice",
+    "isPrivateOwner",
+    "dateCreated",
+    "dateCreatedFirst",
+    "pushedUpAt",
+]
+
+
+def compact_item(item: dict) -> dict:
+    return {field: item.get(field) for field in ITEM_FIELDS}
+
+
+def items_dir(region: str) -> str:
+    """
+    directory where `iter_items` keeps the compact items of every page of the
+    region as <page_number>.jsonl.gz, plus the page count in meta.json
+    """
+    return os.path.join("items", region.replace("/", "_"))
+
+
+def _items_path(region: str, page_number: int) -> str:
+    return os.path.join(items_dir(region), f"{page_number}.jsonl.gz")
+
+
+def write_items(path: str, items: list[dict]):
+    # write-then-rename so a killed run never leaves a truncated file behind
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False))
+            f.write("\n")
+    os.replace(path + ".tmp", path)
+    metrics.count("items.bytes_written", os.path.getsize(path))
+
+
+def read_items(path: str) -> Iterator[dict]:
+    metrics.count("items.bytes_read", os.path.getsize(path))
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _bounded_map(
+    executor: ThreadPoolExecutor,
+    fn: Callable,
+    iterable: Iterable,
+    window: int,
+) -> Iterator:
+    """
+    like `executor.map` but keeps at most `window` results in flight, so
+    a slow consumer doesn't make the workers pile up pages in memory
+    """
+    futures: deque = deque()
+    for arg in iterable:
+        futures.append(executor.submit(fn, arg))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def iter_items(
+    region: str = "pomorskie/gdansk/gdansk/gdansk",
+    workers: int = 4,
+    rate: float = 1.0,
+    burst: int = 2,
+    base_url: str = OTODOM_URL,
+    refresh: bool = False,
+) -> Iterator[dict]:
+    """
+    streams the compact items (see `ITEM_FIELDS`) of every listing page of
+    the region in page order
+
+    each page is fetched, parsed and reduced to its items in a worker, only
+    the items are kept, written to `items_dir(region)` and yielded, so memory
+    stays flat no matter how many pages the region has; pages already in
+    `items_dir(region)` are read from there without fetching or parsing HTML
+
+    :param refresh: ignore the items on disk and fetch everything again
+    :param workers, rate, burst, base_url: see `get_pages`
+    """
+    os.makedirs(items_dir(region), exist_ok=True)
+    meta_path = os.path.join(items_dir(region), "meta.json")
+    session = get_session(workers)
+    rate_limiter = RateLimiter(rate=rate, burst=burst)
+
+    @metrics.timed("scrape", items=len)
+    def fetch_items(page_number: int) -> list[dict]:
+        path = _items_path(region, page_number)
+        if os.path.exists(path) and not refresh:
+            return list(read_items(path))
+        page = get_page(
+            page_number,
+            region=region,
+            session=session,
+            rate_limiter=rate_limiter,
+            base_url=base_url,
+        )
+        if page_number == 1:
+            with open(meta_path, "w+") as f:
+                json.dump({"page_count": get_page_count(page)}, f)
+        items = [
+            compact_item(item)
+            for item in get_items_from_page(page, save=False) or []
+        ]
+        write_items(path, items)
+        return items
+
+    yield from fetch_items(1)
+    with open(meta_path) as f:
+        page_count = json.load(f)["page_count"]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for items in _bounded_map(
+            executor,
+            fetch_items,
+            range(2, page_count + 1),
+            window=2 * workers,
+        ):
+            yield from items
+
+
+def load_items(region: str = "pomorskie/gdansk/gdansk/gdansk") -> Iterator[dict]:
+    """
+    streams the items `iter_items` already saved for the region, offline
+    """
+    paths = [
+        path
+        for path in os.listdir(items_dir(region))
+        if path.endswith(".jsonl.gz")
+    ]
+    for path in sorted(paths, key=lambda path: int(path.split(".")[0])):
+        yield from read_items(os.path.join(items_dir(region), path))
@@ -0,0 +1,126 @@
+import numpy as np
+
+from . import metrics
+
+EARTH_RADIUS_M = 6_371_008.8
+
+
+def to_radians(coords) -> np.ndarray:
+    """
+    turns a list of [lat, lng] pairs (or a (N, 2) array) in degrees into a
+    contiguous (N, 2) float64 array in radians, the layout BallTree expects
+    """
+    return np.radians(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+
+
+def haversine(origins, dests) -> np.ndarray:
+    """
+    vectorized great-circle distance in meters between pairs of [lat, lng]
+    coordinates, origins and dests broadcast against each other
+
+    :param origins: (N, 2) array of [lat, lng] in degrees
+    :param dests: (N, 2) or (2,) array of [lat, lng] in degrees
+    :return: (N,) array of distances in meters
+    """
+    o = np.radians(np.asarray(origins, dtype=np.float64))
+    d = np.radians(np.asarray(dests, dtype=np.float64))
+    dlat = d[..., 0] - o[..., 0]
+    dlng = d[..., 1] - o[..., 1]
+    a = (
+        np.sin(dlat / 2) ** 2
+        + np.cos(o[..., 0]) * np.cos(d[..., 0]) * np.sin(dlng / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class SpatialIndex:
+
+    """
+    haversine BallTree over a set of [lat, lng] coordinates, built once per
+    ammenity type and queried for all of the apartments in one call
+
+    all of the query methods take a (N, 2) array of [lat, lng] in degrees and
+    return indices into the indexed coordinates and distances in meters
+    """
+
+    def __init__(self, coords):
+        # sklearn takes over a second to import, only pay for it once an
+        # index is actually built
+        from sklearn.neighbors import BallTree
+
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self._tree = BallTree(to_radians(self.coords), metric="haversine")
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def nearest(self, query) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (indices, distances), both of shape (N,)
+        """
+        indices, distances = self.k_nearest(query, k=1)
+        return indices[:, 0], distances[:, 0]
+
+    @metrics.timed("nearest", items=lambda result: len(result[0]))
+    def k_nearest(self, query, k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (indices, distances), both of shape (N, k) sorted by distance
+        """
+        k = min(k, len(self))
+        distances, indices = self._tree.query(to_radians(query), k=k)
+        return indices, distances * EARTH_RADIUS_M
+
+    def within_radius(
+        self,
+        query,
+        radius: float,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :param radius: radius in meters
+        :return: (indices, distances), object arrays of shape (N,) where every
+        entry is an array of the places within the radius sorted by distance
+        """
+        indices, distances = self._tree.query_radius(
+            to_radians(query),
+            r=radius / EARTH_RADIUS_M,
+            return_distance=True,
+            sort_results=True,
+        )
+        return indices, distances * EARTH_RADIUS_M
+
+    def count_within_radius(self, query, radius: float) -> np.ndarray:
+        """
+        :param radius: radius in meters
+        :return: (N,) array with the number of places within the radius
+        """
+        return self._tree.query_radius(
+            to_radians(query),
+            r=radius / EARTH_RADIUS_M,
+            count_only=True,
+        )
+
+    def closest_coordinates(self, query) -> list[list[float]]:
+        """
+        drop-in for the per-row `find_closest_coordinates` list comprehension,
+        returns the closest [lat, lng] for every row of the query
+        """
+        indices, _ = self.nearest(query)
+        return self.coords[indices].tolist()
+
+
+# walking routes in a city are typically 1.2-1.4x the great-circle distance,
+# use `detour_factor` on known distances for a better number
+DEFAULT_DETOUR_FACTOR = 1.3
+
+
+def detour_factor(origins, dests, meters) -> float:
+    """
+    median ratio of known route distances to the great-circle distances of the
+    same pairs, pairs closer than 50m are too noisy and left out
+    """
+    great_circle = haversine(origins, dests)
+    meters = np.asarray(meters, dtype=np.float64)
+    usable = (great_circle > 50) & np.isfinite(meters)
+    if not usable.any():
+        return DEFAULT_DETOUR_FACTOR
+    return float(np.median(meters[usable] / great_circle[usable]))
@@ -0,0 +1,249 @@
+import graphlib
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from . import metrics
+
+
+def _canonical_json(obj: Any) -> str:
+    return json.dumps(obj, sort_keys=True, default=_json_default)
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    return repr(obj)
+
+
+def content_hash(obj: Any) -> str:
+    """
+    sha256 of the value of a stage output, the same for equal values no
+    matter how they were built: DataFrames are hashed by their values (and
+    index and columns), list or dict cells, e.g. coords or the raw otodom
+    items, by their canonical JSON; other outputs by their canonical JSON,
+    or by their pickle if they can't be written as JSON
+    """
+    digest = hashlib.sha256()
+    if isinstance(obj, pd.DataFrame):
+        canonical = obj.copy()
+        for column in canonical.columns[canonical.dtypes == object]:
+            canonical[column] = canonical[column].map(
+                lambda value: _canonical_json(value)
+                if isinstance(value, (list, tuple, dict, np.ndarray)) else value
+            )
+        digest.update(
+            pd.util.hash_pandas_object(canonical, index=True).to_numpy().tobytes())
+        digest.update(_canonical_json(list(map(str, obj.columns))).encode())
+        digest.update(_canonical_json(obj.dtypes.astype(str).tolist()).encode())
+        return digest.hexdigest()
+    try:
+        digest.update(json.dumps(obj, sort_keys=True).encode())
+    except (TypeError, ValueError):
+        digest.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    return digest.hexdigest()
+
+
+class Stage:
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable,
+        inputs: list[str],
+        params: dict[str, Any],
+        volatile: bool,
+    ):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs
+        self.params = params
+        self.volatile = volatile
+        try:
+            self.code_hash = hashlib.sha256(
+                inspect.getsource(fn).encode()).hexdigest()
+        except (OSError, TypeError):
+            self.code_hash = getattr(fn, "__qualname__", repr(fn))
+
+    def key(self, input_hashes: list[str]) -> str:
+        """
+        what the output is checkpointed under: a hash of the stage's code,
+        its params and the content hashes of its inputs
+        """
+        return hashlib.sha256(
+            json.dumps(
+                [self.name, self.code_hash, self.params, input_hashes],
+                sort_keys=True,
+                default=str,
+            ).encode()
+        ).hexdigest()
+
+
+class StageGraph:
+
+    """
+    named stages, each a function of the outputs of the stages it takes as
+    inputs and of its params, whose outputs are checkpointed to
+    checkpoint_dir/<stage>/<key>.pkl
+
+    a stage is only recomputed if there is no checkpoint for its key, i.e.
+    if its code, params or the content of one of its inputs changed;
+    only the source of the stage function itself is part of the key, not
+    of the helpers it calls, so after changing a helper the stages using it
+    have to be forced (see `run`);
+    outputs of stages that are served from checkpoint are only loaded if a
+    recomputed stage needs them
+
+    volatile stages, e.g. the ones reading from the outside world, are
+    always recomputed, the stages after them are still served from
+    checkpoint when the output didn't change
+
+    ```Python
+    graph = StageGraph("checkpoints")
+    graph.add("items", fetch, volatile=True)
+    graph.add("df", preprocess, inputs=["items"], params={"compact": True})
+    graph.run()["df"]
+    graph.report()
+    ```
+    """
+
+    def __init__(self, checkpoint_dir: str = "checkpoints", keep: int = 3):
+        """
+        :param keep: checkpoints kept per stage, the most recent ones, so
+        going back to recent params is still served from checkpoint
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.keep = keep
+        self.stages: dict[str, Stage] = {}
+        # name: {"status", "seconds", "key"} of the last run
+        self.statuses: dict[str, dict[str, Any]] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: Callable,
+        inputs: list[str] | None = None,
+        params: dict[str, Any] | None = None,
+        volatile: bool = False,
+    ):
+        """
+        :param fn: called with the outputs of the inputs (in order) as
+        positional and the params as keyword arguments
+        :param params: JSON-serializable, part of the checkpoint key
+        """
+        for input_name in inputs or []:
+            assert input_name in self.stages, f"unknown input {input_name}"
+        self.stages[name] = Stage(
+            name, fn, list(inputs or []), dict(params or {}), volatile)
+
+    def _upstream(self, targets: list[str]) -> list[str]:
+        """
+        the targets and everything they depend on, in topological order
+        """
+        needed: set[str] = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending += self.stages[name].inputs
+        sorter = graphlib.TopologicalSorter(
+            {name: self.stages[name].inputs for name in needed})
+        return list(sorter.static_order())
+
+    def _path(self, name: str, key: str) -> str:
+        return os.path.join(self.checkpoint_dir, name, f"{key}.pkl")
+
+    def run(
+        self,
+        targets: list[str] | None = None,
+        force: list[str] | None = None,
+    ) -> dict[str, Any]:
+        """
+        :param targets: stages to run (and the ones they depend on), all of
+        them by default
+        :param force: stages to recompute even if they have a checkpoint
+        :return: outputs of the targets
+        """
+        targets = targets or list(self.stages)
+        force = set(force or [])
+        self.statuses = {}
+        outputs: dict[str, Any] = {}
+        hashes: dict[str, str] = {}
+        keys: dict[str, str] = {}
+
+        def output(name: str) -> Any:
+            if name not in outputs:
+                with open(self._path(name, keys[name]), "rb") as f:
+                    pickle.load(f)
+                    outputs[name] = pickle.load(f)
+            return outputs[name]
+
+        for name in self._upstream(targets):
+            stage = self.stages[name]
+            keys[name] = stage.key([hashes[i] for i in stage.inputs])
+            path = self._path(name, keys[name])
+            start = time.perf_counter()
+            if not stage.volatile and name not in force and os.path.exists(path):
+                with open(path, "rb") as f:
+                    # the hash is pickled first, so reading it alone is
+                    # cheap and the output only loaded if needed
+                    hashes[name] = pickle.load(f)
+                status = "checkpoint"
+                metrics.count("stages.from_checkpoint")
+            else:
+                with metrics.stage(f"stage.{name}"):
+                    outputs[name] = stage.fn(
+                        *[output(i) for i in stage.inputs], **stage.params)
+                hashes[name] = content_hash(outputs[name])
+                self._save(path, hashes[name], outputs[name])
+                status = "volatile" if stage.volatile else "computed"
+                metrics.count("stages.computed")
+            self.statuses[name] = {
+                "status": status,
+                "seconds": time.perf_counter() - start,
+                "key": keys[name],
+            }
+
+        return {name: output(name) for name in targets}
+
+    def _save(self, path: str, output_hash: str, obj: Any):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb+") as f:
+            pickle.dump(output_hash, f)
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        stage_dir = os.path.dirname(path)
+        checkpoints = sorted(
+            (os.path.join(stage_dir, name) for name in os.listdir(stage_dir)
+             if name.endswith(".pkl")),
+            key=os.path.getmtime,
+        )
+        for old in checkpoints[:-self.keep]:
+            os.remove(old)
+
+    def report(self) -> dict[str, dict[str, Any]]:
+        """
+        prints which stages of the last run were served from checkpoint and
+        which were recomputed
+        """
+        for name, status in self.statuses.items():
+            print(
+                f"{name:<24} {status['status']:<10} "
+                f"{status['seconds']:8.2f}s  {status['key'][:12]}"
+            )
+        return self.statuses
@@ -1,203 +1,663 @@
 #!/usr/bin/env python3
 
+import argparse
+import multiprocessing
+import os
+
+from typing import Any
+
 import pandas as pd
 import numpy as np
-import simplekml
-
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
 
 from lib import (
+    PLACES_RADIUS,
     HowCloseIsItService,
-    get_items_from_page,
-    get_pages,
+    StageGraph,
+    dedup_listings,
+    fan_out,
+    items_fingerprints,
+    iter_changed_items,
+    iter_items,
+    load_dataset,
+    load_fingerprints,
+    make_offer_server,
+    merge_delta,
+    metrics,
+    plan_search_centers,
     preprocess_items_df,
-    find_closest_coordinates,
+    rank_underpriced,
+    save_apartments_kml,
+    save_coords_kml,
+    save_dataset,
+    save_fingerprints,
+    save_places_kml,
+    unique_locations,
 )
 
 
-def show_best_offers(df: pd.DataFrame):
+def show_best_offers(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    the 30 listings under 500k priced furthest below what the model expects
+    for their size and surroundings, see `rank_underpriced`
+    """
     pd.set_option("max_colwidth", 100)
-    df[df["address"].notna()].sort_values(by="price_per_m2")[
-        (df["price"] >= 0) & (df["price"] <= 500_000)
-    ].head(30)
+    best_offers = rank_underpriced(df)
+    print(best_offers[["title", "price", "predicted_price", "price_ratio", "url"]])
+    return best_offers
 
 
-def get_ammenities_df(
-    how_close_service: HowCloseIsItService,
-    location: list[float],
-    use_cache=True,
+AMMENITY_TYPES = [
+    "zabka",
+    "biedronka",
+    "lidl",
+    "stacja paliw",
+    "restauracja",
+    "skm",
+    "pociag",
+]
+
+
+def get_places_around(
+        coordinates: list[list[float]],
+        how_close_service: HowCloseIsItService,
 ):
-    zabki = how_close_service.get_all_of_ammenity(
-        location=location,
-        ammenity="zabka",
-        use_cache=use_cache,
-    )
-    biedronki = how_close_service.get_all_of_ammenity(
-        location=location,
-        ammenity="biedronka",
-        use_cache=use_cache,
-    )
-    lidle = how_close_service.get_all_of_ammenity(
-        location=location,
-        ammenity="lidl",
-        use_cache=use_cache,
-    )
-    stacje = how_close_service.get_all_of_ammenity(
-        location=location,
-        ammenity="stacja paliw",
-        use_cache=use_cache,
-    )
-    restauracje = how_close_service.get_all_of_ammenity(
-        location=location,
-        ammenity="restauracja",
-        use_cache=use_cache,
-    )
-    skm = how_close_service.get_all_of_ammenity(
-        location=location,
-        ammenity="skm",
-        use_cache=use_cache,
-    )
-    pociagi = how_close_service.get_all_of_ammenity(
-        location=location,
-        ammenity="pociag",
-        use_cache=use_cache,
-    )
-    return pd.DataFrame(
-        [
-            *zabki.values(),
-            *biedronki.values(),
-            *lidle.values(),
-            *stacje.values(),
-            *restauracje.values(),
-            *skm.values(),
-            *pociagi.values(),
-        ]
+    """
+    searches every ammenity type around as few centers as needed for all of
+    the apartments to be within PLACES_RADIUS of one of them (see
+    `plan_search_centers`), areas already searched for a type are skipped
+
+    this is useful to fill the cache of the HowCloseIsItService to return
+    larger ammenities df that covers more area
+
+    :param coordinates: array of coordinates
+    :param how_close_service: HowCloseIsItService
+    """
+    jobs = []
+    all_centers = []
+    for ammenity in AMMENITY_TYPES:
+        centers = plan_search_centers(
+            coordinates,
+            radius=PLACES_RADIUS,
+            searched=how_close_service.searched_centers(ammenity),
+        ).tolist()
+        jobs += [(ammenity, center) for center in centers]
+        all_centers += [c for c in centers if c not in all_centers]
+    print(f"places searches planned: {len(jobs)} around {len(all_centers)} centers")
+    metrics.count("places.planned_searches", len(jobs))
+    if not jobs:
+        return
+    save_coords_kml(
+        os.path.join(how_close_service.ammenities_dir, "search_centers"),
+        all_centers,
+        name="Search Center",
     )
+    how_close_service.fetch_ammenities(jobs)
 
 
-def save_klm(file_name: str, list_of_coords: list[list[float]]):
-    kml = simplekml.Kml()
+# ammenities below the rating are left out of the closest ammenities
+MIN_RATINGS = {"restauracja": 4}
 
-    for coords in list_of_coords:
-        lat, lon = coords
-        kml.newpoint(name="Cluster Center", coords=[(lon, lat)])
 
-    file_path = file_name + ".kml"
-    kml.save(file_path)
+def geocode_df(
+    df: pd.DataFrame,
+    all_items_df: pd.DataFrame,
+    how_close_service: HowCloseIsItService,
+) -> pd.DataFrame:
+    """
+    adds the [lat, lng] `coords` of every listing
+
+    :param df: preprocessed listings, indexed like all_items_df
+    :param all_items_df: the raw items df was preprocessed from
+    """
+    df = df.copy()
+    coords = []
+    with metrics.stage("enrich.geocode", items=len(df)):
+        for index, address in df["address"].items():
+            res = how_close_service.geocode(
+                address,
+                item=all_items_df.loc[index].to_dict(),
+            )
+            coords.append(how_close_service.response_to_coords(res))
+    how_close_service.geocoder.report()
 
-    print(f"KML file saved at: {file_path}")
+    df["coords"] = coords
+    return df
 
 
-def get_top_clusters_centers(coords: list[list[float]]):
-    kmeans = KMeans(n_clusters=10, random_state=0,)
-    coordinates = np.array(coords)
-    kmeans.fit(coordinates)
-    cluster_centers = kmeans.cluster_centers_
-    cluster_labels = kmeans.labels_
-    cluster_counts = np.bincount(cluster_labels)
-    top_clusters_indices = np.argsort(cluster_counts)[::-1][:10]
-    top_clusters_centers = cluster_centers[top_clusters_indices]
-    return top_clusters_centers
+def add_distance_to_center(
+    df: pd.DataFrame,
+    how_close_service: HowCloseIsItService,
+    max_distance: float = 20_000,
+) -> pd.DataFrame:
+    """
+    drops the listings further than max_distance from the city center, or
+    with no walking route to it, and adds the walking `distance_to_center`
+    of the rest
+    """
+    # the cut-off is coarse, only the listings close to it need a walking
+    # distance to be decided
+    with metrics.stage("enrich.distance_to_center", items=len(df)):
+        city_center = how_close_service.city_center()
+        coords = df["coords"].tolist()
+        # the estimate scales great-circle distances by the detour factor of
+        # the walking distances to the center cached by earlier runs
+        how_close_service.calibrate_detour_factor(
+            coords, [city_center] * len(coords))
+        estimate = how_close_service.distance_column(
+            coords,
+            [city_center],
+            mode="estimate",
+            threshold=max_distance,
+        )
+        far_from_center = estimate >= max_distance
+        print("dropping far out of center: ", far_from_center.sum())
+        # NaN where the API found no route
+        df = df[~far_from_center & ~np.isnan(estimate)].copy()
+
+        df["distance_to_center"] = how_close_service.distance_column(
+            df["coords"].tolist(),
+            [city_center],
+        )
+        no_route = int(np.isnan(estimate).sum() + df["distance_to_center"].isna().sum())
+        print("dropping without a route to the center: ", no_route)
+        metrics.count("enrich.no_route_to_center", no_route)
+        df = df[df["distance_to_center"].notna()]
+    return df
 
 
-if __name__ == "__main__":
-    pages = get_pages(load=True)
+def _add_closest_ammenities(
+    df: pd.DataFrame,
+    how_close_service: HowCloseIsItService,
+    min_ratings: dict[str, float] = MIN_RATINGS,
+):
+    ammenities = how_close_service.ammenities_table(AMMENITY_TYPES)
+
+    apartment_coords = np.array(df["coords"].tolist())
+    for ammenity_type in ammenities.types:
+        ammenity = ammenities.view(ammenity_type)
+        if ammenity_type in min_ratings:
+            print(
+                f"filtering out {ammenity_type} with rating less than "
+                f"{min_ratings[ammenity_type]}"
+            )
+            ammenity = ammenity.filter(ammenity.rating >= min_ratings[ammenity_type])
+        if not len(ammenity):
+            print(f"no {ammenity_type} in the ammenities cache, skipping")
+            continue
+        df["closest_" + ammenity_type] = ammenity.index.closest_coordinates(
+            apartment_coords,
+        )
 
-    assert get_items_from_page(pages[2]) is not None
+        df["distance_to_closest_" + ammenity_type] = how_close_service.distance_column(
+            df["coords"].tolist(),
+            df["closest_" + ammenity_type].tolist(),
+        )
 
-    all_items = []
-    for page in pages:
-        items = get_items_from_page(page)
-        if items is not None and len(items):
-            all_items += items
-    all_items_df = pd.DataFrame(all_items)
 
-    df = preprocess_items_df(all_items_df)
-    print("got: ", df.shape)
+def _add_accessibility(
+    df: pd.DataFrame,
+    how_close_service: HowCloseIsItService,
+):
+    """
+    adds the number of ammenities of every type within 500m and 1km, looked
+    up in the accessibility grid
+    """
+    grid = how_close_service.accessibility_grid(
+        df["coords"].tolist(), AMMENITY_TYPES)
+    for ammenity_type in grid.types:
+        for radius in grid.radii:
+            df[f"{ammenity_type}_within_{radius}m"] = grid.count_at(
+                df["coords"].tolist(),
+                ammenity_type,
+                radius,
+            )
 
-    how_close_service = HowCloseIsItService()
 
-    coords = []
-    for address in df["address"].values:
-        res = how_close_service.geocode(address)
-        coords.append(how_close_service.response_to_coords(res))
+DEFAULT_REGION = "pomorskie/gdansk/gdansk/gdansk"
+
+TRICITY = [
+    "pomorskie/gdansk/gdansk/gdansk",
+    "pomorskie/gdynia/gdynia/gdynia",
+    "pomorskie/sopot/sopot/sopot",
+]
+
+
+def region_dir(region: str) -> str:
+    """
+    output directory of a region in a multi-region run, hive-style so the
+    combined dataset can be read back partitioned by region
+    """
+    return os.path.join("data", f"region={region_slug(region)}")
+
+
+def region_slug(region: str) -> str:
+    return region.replace("/", "_")
+
+
+def region_city(region: str) -> str:
+    """
+    the city whose center the distances of the region are measured from,
+    e.g. "gdansk" for "pomorskie/gdansk/gdansk/gdansk"
+    """
+    return region.rstrip("/").split("/")[-1].replace("-", " ")
+
+
+def region_service(
+    region: str = DEFAULT_REGION,
+    city: str | None = None,
+    output_dir: str = ".",
+) -> HowCloseIsItService:
+    return HowCloseIsItService(
+        city=city or ("Gdańsk" if region == DEFAULT_REGION else region_city(region)),
+        ammenities_dir=output_dir,
+    )
+
+
+STAGES = [
+    "fetch_items",
+    "preprocess",
+    "dedup",
+    "geocode",
+    "distance_to_center",
+    "fetch_ammenities",
+    "closest_ammenities",
+    "accessibility",
+    "fan_out",
+]
 
-    df["coords"] = coords
 
-    df["distance_to_center"] = [
-        how_close_service.get_distance(
-            [coords],
-            [how_close_service.city_center()],  # type: ignore
+def build_stages(
+    region: str,
+    how_close_service: HowCloseIsItService,
+    checkpoint_dir: str = "checkpoints",
+    max_distance: float = 20_000,
+    min_ratings: dict[str, float] = MIN_RATINGS,
+    refresh: bool = False,
+    items_df: pd.DataFrame | None = None,
+) -> StageGraph:
+    """
+    the pipeline of `run_region` as checkpointed STAGES, e.g. changing
+    min_ratings only recomputes closest_ammenities and accessibility; every
+    location is only enriched once, see `dedup_listings`
+
+    fetch_items always runs, but reads the items cached on disk (see
+    `iter_items`) unless refresh, the stages after it only recompute if the
+    listings changed
+
+    :param refresh: scrape the region again instead of reading the items
+    on disk
+    :param items_df: raw items fetch_items returns instead, e.g. the new or
+    changed ones of an incremental run
+    """
+    graph = StageGraph(checkpoint_dir)
+
+    def fetch_items(region, refresh):
+        if items_df is not None:
+            return items_df
+        with metrics.stage("fetch_items"):
+            all_items_df = pd.DataFrame(iter_items(region=region, refresh=refresh))
+        metrics.add_items("fetch_items", len(all_items_df))
+        return all_items_df
+
+    def geocode(listings, all_items_df):
+        return geocode_df(
+            unique_locations(listings), all_items_df, how_close_service)
+
+    def distance_to_center(df, city, max_distance):
+        return add_distance_to_center(df, how_close_service, max_distance)
+
+    def fetch_ammenities(df, types):
+        # the places fetched change what the stages after it compute
+        get_places_around(df["coords"].tolist(), how_close_service)
+        return {t: how_close_service.ammenities_cache.get(t, {}) for t in types}
+
+    def closest_ammenities(df, ammenities, min_ratings):
+        df = df.copy()
+        _add_closest_ammenities(df, how_close_service, min_ratings)
+        return df
+
+    def accessibility(df, ammenities):
+        df = df.copy()
+        _add_accessibility(df, how_close_service)
+        return df
+
+    graph.add(
+        "fetch_items",
+        fetch_items,
+        params={"region": region, "refresh": refresh},
+        volatile=True,
+    )
+    graph.add("preprocess", preprocess_items_df, inputs=["fetch_items"])
+    graph.add("dedup", dedup_listings, inputs=["preprocess"])
+    graph.add("geocode", geocode, inputs=["dedup", "fetch_items"])
+    graph.add(
+        "distance_to_center",
+        distance_to_center,
+        inputs=["geocode"],
+        params={"city": how_close_service.city, "max_distance": max_distance},
+    )
+    graph.add(
+        "fetch_ammenities",
+        fetch_ammenities,
+        inputs=["distance_to_center"],
+        params={"types": AMMENITY_TYPES},
+    )
+    graph.add(
+        "closest_ammenities",
+        closest_ammenities,
+        inputs=["distance_to_center", "fetch_ammenities"],
+        params={"min_ratings": min_ratings},
+    )
+    graph.add(
+        "accessibility",
+        accessibility,
+        inputs=["closest_ammenities", "fetch_ammenities"],
+    )
+    graph.add("fan_out", fan_out, inputs=["accessibility", "dedup"])
+    return graph
+
+
+def run_stage(
+    stage: str,
+    region: str = DEFAULT_REGION,
+    output_dir: str = ".",
+    force: list[str] | None = None,
+    refresh: bool = False,
+) -> Any:
+    """
+    runs one of STAGES (and whatever it needs that has no valid checkpoint)
+    and prints which stages came from checkpoint
+
+    :param refresh: see `build_stages`
+    :return: the output of the stage
+    """
+    how_close_service = region_service(region, output_dir=output_dir)
+    graph = build_stages(
+        region,
+        how_close_service,
+        os.path.join(output_dir, "checkpoints"),
+        refresh=refresh,
+    )
+    output = graph.run([stage], force=force)[stage]
+    graph.report()
+    how_close_service.flush()
+    return output
+
+
+def run_region(
+    region: str = DEFAULT_REGION,
+    city: str | None = None,
+    output_dir: str = ".",
+    incremental: bool = False,
+    profile: bool = False,
+    force: list[str] | None = None,
+    refresh: bool = False,
+) -> str:
+    """
+    scrapes, preprocesses and enriches one region and writes its
+    final_df.parquet (see lib.dataset), fingerprints, KML files and run_report.json (see
+    lib.metrics) to output_dir
+
+    the geocode and distance caches are the shared ones in the CWD, the
+    ammenities cache is the region's own in output_dir
+
+    :param city: see `region_city`, "Gdańsk" for the default region
+    :param profile: dump a cProfile of every stage to output_dir/profiles
+    :param force: STAGES to recompute even if they have a checkpoint
+    :param refresh: scrape the whole region again instead of reading the
+    items on disk, see `build_stages`; an incremental run always scrapes,
+    but only the newest pages
+    :return: path of the region's final_df.parquet
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    metrics.reset()
+    if profile:
+        metrics.enable_profiling(os.path.join(output_dir, "profiles"))
+    final_df_path = os.path.join(output_dir, "final_df.parquet")
+    legacy_final_df_path = os.path.join(output_dir, "final_df.pkl")
+    fingerprints_path = os.path.join(output_dir, "fingerprints.json")
+
+    how_close_service = region_service(region, city, output_dir)
+
+    final_df = None
+    fingerprints = load_fingerprints(fingerprints_path)
+    if incremental and os.path.exists(final_df_path):
+        final_df = load_dataset(final_df_path, flat=False)
+    elif incremental and os.path.exists(legacy_final_df_path):
+        final_df = pd.read_pickle(legacy_final_df_path)
+    if final_df is not None:
+        with metrics.stage("fetch_items"):
+            all_items_df = pd.DataFrame(
+                iter_changed_items(fingerprints, region=region))
+        print("new or changed listings: ", len(all_items_df))
+        if all_items_df.empty:
+            if not os.path.exists(final_df_path):
+                save_dataset(final_df, final_df_path)
+            return final_df_path
+        metrics.add_items("fetch_items", len(all_items_df))
+
+        # the same stages as a full run, checkpointed apart from it so the
+        # deltas don't push out its checkpoints
+        graph = build_stages(
+            region,
+            how_close_service,
+            os.path.join(output_dir, "checkpoints", "delta"),
+            items_df=all_items_df,
+        )
+        df = graph.run(["preprocess"], force=force)["preprocess"]
+        print("got: ", df.shape)
+        # e.g. every changed listing hides its price, nothing to enrich, the
+        # old rows of the changed listings are still dropped
+        if not df.empty:
+            df = graph.run(["fan_out"], force=force)["fan_out"]
+            graph.report()
+        df = merge_delta(final_df, df, changed_ids=all_items_df["id"])
+    else:
+        graph = build_stages(
+            region,
+            how_close_service,
+            os.path.join(output_dir, "checkpoints"),
+            refresh=refresh,
+        )
+        outputs = graph.run(["fetch_items", "fan_out"], force=force)
+        graph.report()
+        all_items_df, df = outputs["fetch_items"], outputs["fan_out"]
+        print("got: ", df.shape)
+
+    ammenities = how_close_service.ammenities_table(AMMENITY_TYPES)
+    save_apartments_kml(df, os.path.join(output_dir, "apartments"), ammenities)
+    save_places_kml(ammenities, os.path.join(output_dir, "ammenities"))
+    save_places_kml(
+        ammenities.view("biedronka"), os.path.join(output_dir, "biedronki"))
+
+    heatmaps_dir = os.path.join(output_dir, "heatmaps")
+    os.makedirs(heatmaps_dir, exist_ok=True)
+    grid = how_close_service.accessibility_grid(
+        df["coords"].tolist(), AMMENITY_TYPES)
+    for ammenity_type in grid.types:
+        grid.save_heatmap_kml(
+            os.path.join(heatmaps_dir, ammenity_type.replace(" ", "_")),
+            ammenity_type,
         )
-        for coords in df["coords"].values
-    ]
-
-    print("dropping far out of center: ", len(
-        df[df["distance_to_center"] > 20_000]))
-    df = df[df["distance_to_center"] < 20_000]
-
-    coordinates = df["coords"].tolist()
-    save_klm("apartments", coordinates)
-
-    def get_places_around_clusters(
-            coordinates: list[list[float]],
-            how_close_service: HowCloseIsItService,
-    ):
-        """
-        get all ammenities around 10 clusters of coordinates to picture the
-        region of all of the aparments
-
-        this is useful to fill the cache of the HowCloseIsItService to return
-        larger ammenities df that covers more area
-
-        :param coordinates: array of coordinates
-        :param how_close_service: HowCloseIsItService
-        """
-        top_clusters_centers = get_top_clusters_centers(coordinates)
-        save_klm("clusters", top_clusters_centers.tolist())
-        for location in top_clusters_centers:
-            get_ammenities_df(
-                how_close_service=how_close_service,
-                location=location,
-                use_cache=False,
-            )
 
-    ammenities_df = get_ammenities_df(
-        how_close_service=how_close_service,
-        location=how_close_service.city_center(),
-        use_cache=True,
-    )
-
-    # TODO include labels of the places in the kml files
-    save_klm("ammenities", ammenities_df["coords"].to_numpy().tolist())
-    save_klm("biedronki", ammenities_df[ammenities_df["ammenity"]
-             == "biedronka"]["coords"].to_numpy().tolist())
-
-    for ammenity_type in ammenities_df["ammenity"].unique():
-        ammenity_df = ammenities_df[ammenities_df["ammenity"] == ammenity_type]
-        if ammenity_type == "restauracja":
-            print("filtering out restaurants with rating less than 4")
-            ammenity_df = ammenity_df[ammenity_df["rating"] >= 4]
-        df["closest_" + ammenity_type] = [
-            find_closest_coordinates(
-                np.array(coords),
-                ammenity_df["coords"].to_numpy(),
-            )
-            for coords in df["coords"].values
-        ]
-
-        apartment_coords = df["coords"]
-        closest_ammenity_coords = df["closest_" + ammenity_type]
-        distance_to_closest = []
-        for apartment_coord, closest_ammenity_coord in zip(apartment_coords, closest_ammenity_coords):
-            distance_to_closest.append(
-                how_close_service.get_distance(
-                    [apartment_coord],
-                    [closest_ammenity_coord],
-                )
-            )
-        df["distance_to_closest_" + ammenity_type] = distance_to_closest
+    how_close_service.flush()
+
+    save_dataset(df, final_df_path)
+
+    save_fingerprints(
+        {**fingerprints, **items_fingerprints(all_items_df)},
+        fingerprints_path,
+    )
+    metrics.report(os.path.join(output_dir, "run_report.json"))
+    return final_df_path
+
+
+def _run_region_worker(args: tuple[str, bool, bool, bool]) -> str:
+    region, incremental, profile, refresh = args
+    return run_region(
+        region,
+        output_dir=region_dir(region),
+        incremental=incremental,
+        profile=profile,
+        refresh=refresh,
+    )
+
+
+def run_regions(
+    regions: list[str],
+    processes: int = 4,
+    incremental: bool = False,
+    profile: bool = False,
+    refresh: bool = False,
+) -> pd.DataFrame:
+    """
+    runs `run_region` for every region in its own process and combines the
+    results into data/final_df, a Parquet dataset partitioned by region
+    (`region_slug`); the per-region frames stay in `region_dir(region)`
+
+    ```Python
+    load_dataset("data/final_df", filters=[("region", "=", "pomorskie_sopot_sopot_sopot")])
+    ```
+
+    the processes share the SQLite geocode and distance caches, every region
+    has its own ammenities cache
+    """
+    with multiprocessing.Pool(processes=min(processes, len(regions))) as pool:
+        paths = pool.map(
+            _run_region_worker,
+            [(region, incremental, profile, refresh) for region in regions],
+        )
 
-    with open("final_df.pkl", "wb+") as f:
-        df.to_pickle(f)
+    combined_df = pd.concat(
+        [
+            load_dataset(path).assign(region=region_slug(region))
+            for region, path in zip(regions, paths)
+        ],
+        ignore_index=True,
+    )
+    save_dataset(
+        combined_df,
+        os.path.join("data", "final_df"),
+        partition_cols=["region"],
+    )
+    print("combined: ", combined_df.shape)
+    return combined_df
+
+
+def migrate_distance_cache(final_df_paths: list[str]) -> int:
+    """
+    rekeys the legacy sha256 entries of the distance cache (and of an
+    imported distance_cache.pkl) for every apartment with the city center
+    and its closest ammenities in the given final_df.parquet/.pkl files,
+    see `HowCloseIsItService.migrate_distance_cache`
+
+    :return: number of entries migrated
+    """
+    how_close_service = HowCloseIsItService()
+    city_center = how_close_service.city_center()
+    origins, dests = [], []
+    for path in final_df_paths:
+        if path.endswith(".pkl"):
+            df = pd.read_pickle(path)
+        else:
+            df = load_dataset(path, flat=False)
+        for column in [c for c in df.columns if c.startswith("closest_")]:
+            known = df[df[column].notna()]
+            origins += known["coords"].tolist()
+            dests += known[column].tolist()
+        origins += df["coords"].tolist()
+        dests += [city_center] * len(df)
+    migrated = how_close_service.migrate_distance_cache(origins, dests)
+    how_close_service.flush()
+    return migrated
+
+
+def serve(final_df_path: str = "final_df.parquet", port: int = 8000):
+    """
+    answers offer queries over final_df_path until interrupted, see
+    `make_offer_server`
+    """
+    server = make_offer_server(load_dataset(final_df_path), port=port)
+    print(f"serving {final_df_path} at http://127.0.0.1:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only fetch and enrich listings that are new or changed since "
+        "final_df.parquet was written, and merge them into it",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="scrape the listings again instead of reading the ones in items/ "
+        "from the last run",
+    )
+    parser.add_argument(
+        "--regions",
+        nargs="+",
+        help="otodom regions to run in parallel, e.g. "
+        "pomorskie/gdynia/gdynia/gdynia, or 'tricity'; outputs go to data/",
+    )
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="dump a cProfile of every stage next to the run report",
+    )
+    parser.add_argument(
+        "--migrate-distance-cache",
+        nargs="*",
+        metavar="FINAL_DF",
+        help="rekey the legacy distance cache entries of the pairs in the "
+        "given final_df files (final_df.pkl by default) and exit",
+    )
+    parser.add_argument(
+        "--stage",
+        choices=STAGES,
+        help="only run this stage (and what it needs that has no checkpoint) "
+        "of the default region",
+    )
+    parser.add_argument(
+        "--force",
+        nargs="+",
+        choices=STAGES,
+        default=[],
+        help="recompute these stages even if they have a checkpoint",
+    )
+    parser.add_argument(
+        "--serve",
+        nargs="?",
+        const="final_df.parquet",
+        metavar="FINAL_DF",
+        help="serve offer queries over final_df.parquet (or the given "
+        "dataset) over HTTP, e.g. /offers?max_price=500000&near=skm:800",
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+    elif args.migrate_distance_cache is not None:
+        migrate_distance_cache(args.migrate_distance_cache or ["final_df.pkl"])
+    elif args.stage:
+        run_stage(args.stage, force=args.force, refresh=args.refresh)
+    elif args.regions:
+        regions = TRICITY if args.regions == ["tricity"] else args.regions
+        run_regions(
+            regions, args.processes, args.incremental, args.profile, args.refresh)
+    else:
+        run_region(
+            incremental=args.incremental,
+            profile=args.profile,
+            force=args.force,
+            refresh=args.refresh,
+        )